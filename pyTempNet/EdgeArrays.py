@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar, array-based storage of time-stamped edges, along with read-only
+dictionary and sequence views used by TemporalNetwork for storage ARRAY.
+"""
+
+import sys
+import numpy as np
+
+from collections.abc import Mapping
+from collections.abc import Sequence
+
+from pyTempNet.Log import *
+
+
+class EdgeArrays:
+    """A compact, columnar representation of a sequence of time-stamped edges. Node names are
+    interned to contiguous integer ids, while sources, targets and time stamps of edges are stored
+    in parallel numpy arrays which are sorted by time. Both the time stamps and the activities of
+    nodes are indexed by CSR-style offset arrays."""
+
+    def __init__(self, nodes=None, src=None, dst=None, times=None):
+        """Constructor generating an edge array instance
+
+        @param nodes: an optional list of node names. The position of a node in this list
+            is used as its integer id. Note that this list is shared (and extended) by the instance.
+        @param src: an optional array of integer source node ids
+        @param dst: an optional array of integer target node ids
+        @param times: an optional array of time stamps
+        """
+        if nodes is None:
+            nodes = []
+
+        # The list of node names, where the position of a node corresponds to its integer id
+        self.nodes = nodes
+
+        # A dictionary mapping node names to integer ids
+        self.node_ids = {}
+        for i in range(len(nodes)):
+            self.node_ids[nodes[i]] = i
+
+        if src is None:
+            src = np.zeros(0, dtype=np.int32)
+            dst = np.zeros(0, dtype=np.int32)
+            times = np.zeros(0, dtype=np.int64)
+
+        # Buffers for edges which have been appended but not yet merged into the arrays
+        self._pending = []
+
+        self._build(np.asarray(src, dtype=np.int32), np.asarray(dst, dtype=np.int32), np.asarray(times))
+
+
+    def _build(self, src, dst, times):
+        """Sorts edges by time and (re)generates the offset arrays"""
+
+        # A stable sort ensures that edges with the same time stamp keep their insertion order
+        order = np.argsort(times, kind='mergesort')
+        self.src = src[order]
+        self.dst = dst[order]
+        self.times = times[order]
+
+        # CSR-style index over time: edges with time stamp time_values[i] are stored
+        # in the range [time_ptr[i], time_ptr[i+1])
+        self._indexTimes()
+
+        # CSR-style index over sources: the sorted, unique time stamps at which node v is
+        # the source of an edge are stored in act_times[act_ptr[v]:act_ptr[v+1]]
+        n = len(self.nodes)
+        if len(self.src) > 0:
+            act_order = np.lexsort((self.times, self.src))
+            s = self.src[act_order]
+            ts = self.times[act_order]
+            keep = np.ones(len(s), dtype=bool)
+            keep[1:] = (s[1:] != s[:-1]) | (ts[1:] != ts[:-1])
+            self.act_times = ts[keep]
+            self.act_ptr = np.zeros(n+1, dtype=np.int64)
+            np.cumsum(np.bincount(s[keep], minlength=n), out=self.act_ptr[1:])
+        else:
+            self.act_times = np.zeros(0, dtype=self.times.dtype)
+            self.act_ptr = np.zeros(n+1, dtype=np.int64)
+
+        # The index over sources of links is generated on first use (see outLinks)
+        self._out = None
+
+        # Incremented whenever the arrays change, so that views can invalidate cached data
+        self.version = getattr(self, 'version', 0) + 1
+
+
+    def _indexTimes(self):
+        """(Re)generates the CSR-style index over the sorted time stamps of edges"""
+        first = np.ones(len(self.times), dtype=bool)
+        first[1:] = self.times[1:] != self.times[:-1]
+        starts = np.flatnonzero(first)
+        self.time_values = self.times[starts]
+        self.time_ptr = np.append(starts, len(self.times)).astype(np.int64)
+
+
+    def outLinks(self):
+        """Returns a CSR-style index over the sources of links as a tuple of arrays 
+        (out_ptr, out_times, out_dst). The time stamps and targets of all links (v,*;ts) 
+        are stored, sorted by time, at positions [out_ptr[v], out_ptr[v+1])"""
+        self.flush()
+        if self._out is None:
+            n = len(self.nodes)
+            order = np.lexsort((self.times, self.src))
+            out_ptr = np.zeros(n+1, dtype=np.int64)
+            np.cumsum(np.bincount(self.src, minlength=n), out=out_ptr[1:])
+            self._out = (out_ptr, self.times[order], self.dst[order])
+        return self._out
+
+
+    def nodeId(self, v):
+        """Returns the integer id of node v, adding v to the list of nodes if necessary"""
+        i = self.node_ids.get(v, -1)
+        if i < 0:
+            i = len(self.nodes)
+            self.node_ids[v] = i
+            self.nodes.append(v)
+        return i
+
+
+    def append(self, source, target, ts):
+        """Appends a time-stamped edge (source,target;ts). Appended edges are buffered
+        and merged into the sorted arrays whenever the arrays are accessed next.
+        """
+        self._pending.append((self.nodeId(source), self.nodeId(target), ts))
+
+
+    def flush(self):
+        """Merges all buffered edges into the sorted edge arrays. Rather than sorting all edges
+        again, buffered edges are inserted at the positions found by binary search. For P buffered
+        edges and E edges in total, a flush thus takes O(P log E) time plus a single copy of the
+        arrays in O(E), so that adding edges one at a time (with accesses in between) costs O(E)
+        per edge. Adding edges in bulk before accessing the arrays is therefore much faster. Large
+        buffers (more than E/16 edges) are merged by sorting all edges again."""
+        n = len(self.nodes)
+        if len(self._pending) == 0 and len(self.act_ptr) == n+1:
+            return
+        if len(self._pending) * 16 > len(self.src):
+            src = np.concatenate((self.src, np.array([e[0] for e in self._pending], dtype=np.int32)))
+            dst = np.concatenate((self.dst, np.array([e[1] for e in self._pending], dtype=np.int32)))
+            times = np.array([e[2] for e in self._pending])
+            if len(self.times) > 0:
+                times = np.concatenate((self.times, times))
+            self._pending = []
+            self._build(src, dst, times)
+            return
+
+        # Nodes which have been added since the last flush are not active at any time
+        act_ptr = np.append(self.act_ptr, np.repeat(self.act_ptr[-1], n+1-len(self.act_ptr)))
+        if len(self._pending) == 0:
+            self.act_ptr = act_ptr
+            return
+
+        src = np.array([e[0] for e in self._pending], dtype=np.int32)
+        dst = np.array([e[1] for e in self._pending], dtype=np.int32)
+        times = np.array([e[2] for e in self._pending])
+        self._pending = []
+
+        # Insert edges after all edges with the same time stamp, so that insertion order is kept
+        order = np.argsort(times, kind='mergesort')
+        src = src[order]
+        dst = dst[order]
+        times = times[order]
+        dtype = np.result_type(self.times, times)
+        pos = np.searchsorted(self.times, times, side='right')
+        self.src = np.insert(self.src, pos, src)
+        self.dst = np.insert(self.dst, pos, dst)
+        self.times = np.insert(self.times.astype(dtype, copy=False), pos, times)
+        self._indexTimes()
+
+        # Insert time stamps at which nodes become active into the index over sources
+        act_times = self.act_times.astype(dtype, copy=False)
+        new_pos = []
+        new_src = []
+        new_times = []
+        for v, ts in sorted(set(zip(src.tolist(), times.tolist()))):
+            start = act_ptr[v]
+            end = act_ptr[v+1]
+            i = start + np.searchsorted(act_times[start:end], ts)
+            if i == end or act_times[i] != ts:
+                new_pos.append(i)
+                new_src.append(v)
+                new_times.append(ts)
+        self.act_times = np.insert(act_times, np.array(new_pos, dtype=np.int64), np.array(new_times, dtype=dtype))
+        act_ptr[1:] += np.cumsum(np.bincount(np.array(new_src, dtype=np.int64), minlength=n))
+        self.act_ptr = act_ptr
+
+        self._out = None
+        self.version += 1
+
+
+    def ecount(self):
+        """Returns the number of time-stamped edges"""
+        return len(self.src) + len(self._pending)
+
+
+    def timeRange(self, t):
+        """Returns the range [start, end) of array positions of all edges with time stamp t"""
+        self.flush()
+        i = np.searchsorted(self.time_values, t)
+        if i < len(self.time_values) and self.time_values[i] == t:
+            return self.time_ptr[i], self.time_ptr[i+1]
+        return 0, 0
+
+
+    def edge(self, i):
+        """Returns the i-th time-stamped edge (in time order) as a tuple (source, target, time)"""
+        return (self.nodes[self.src[i]], self.nodes[self.dst[i]], self.times[i].item())
+
+
+    def edges(self, start, end):
+        """Returns a list of time-stamped edges (source, target, time) stored at
+        array positions [start, end)"""
+        nodes = self.nodes
+        return [(nodes[s], nodes[d], ts) for s, d, ts in
+            zip(self.src[start:end].tolist(), self.dst[start:end].tolist(), self.times[start:end].tolist())]
+
+
+    def nbytes(self):
+        """Returns the number of bytes occupied by the edge and index arrays"""
+        self.flush()
+        return (self.src.nbytes + self.dst.nbytes + self.times.nbytes + self.time_values.nbytes +
+            self.time_ptr.nbytes + self.act_times.nbytes + self.act_ptr.nbytes)
+
+
+def edgeArraysFromTEdges(tedges, nodes=None):
+    """Generates an EdgeArrays instance from a list of time-stamped edges (v,w,t). Node ids
+    are assigned in the order in which nodes are first encountered.
+
+    @param tedges: an iterable of time-stamped edges (v,w,t)
+    @param nodes: an optional list of node names, which fixes the ids of the contained nodes
+    """
+    ea = EdgeArrays(nodes=nodes)
+    node_id = ea.nodeId
+    n = len(tedges)
+    src = np.empty(n, dtype=np.int32)
+    dst = np.empty(n, dtype=np.int32)
+    times = [0]*n
+    i = 0
+    for e in tedges:
+        src[i] = node_id(e[0])
+        dst[i] = node_id(e[1])
+        times[i] = e[2]
+        i += 1
+    ea._build(src, dst, np.array(times))
+    return ea
+
+
+class TEdgesView(Sequence):
+    """A read-only sequence of time-stamped edges (v,w,t) backed by an EdgeArrays instance"""
+
+    def __init__(self, ea):
+        self.ea = ea
+
+    def __len__(self):
+        return self.ea.ecount()
+
+    def __getitem__(self, i):
+        self.ea.flush()
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step > 0:
+                return self.ea.edges(start, stop)[::step]
+            return [self.ea.edge(j) for j in range(start, stop, step)]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('edge index out of range')
+        return self.ea.edge(i)
+
+    def __iter__(self):
+        self.ea.flush()
+        # Materialize edge tuples in blocks to limit memory consumption
+        block = 100000
+        for start in range(0, len(self.ea.src), block):
+            for e in self.ea.edges(start, start+block):
+                yield e
+
+
+class OrderedTimesView(Sequence):
+    """A read-only, ordered sequence of all time stamps backed by an EdgeArrays instance"""
+
+    def __init__(self, ea):
+        self.ea = ea
+
+    def __len__(self):
+        self.ea.flush()
+        return len(self.ea.time_values)
+
+    def __getitem__(self, i):
+        self.ea.flush()
+        return self.ea.time_values[i]
+
+
+class TimeView(Mapping):
+    """A read-only dictionary view storing all time-stamped links, indexed by time stamps"""
+
+    def __init__(self, ea):
+        self.ea = ea
+
+    def __getitem__(self, t):
+        start, end = self.ea.timeRange(t)
+        return self.ea.edges(start, end)
+
+    def __contains__(self, t):
+        start, end = self.ea.timeRange(t)
+        return end > start
+
+    def __iter__(self):
+        self.ea.flush()
+        return iter(self.ea.time_values.tolist())
+
+    def __len__(self):
+        self.ea.flush()
+        return len(self.ea.time_values)
+
+
+class NodeIndexView(TimeView):
+    """A read-only dictionary view storing all time-stamped links, indexed by time and
+    either the source (column=0) or the target (column=1) node. Generating the index for a
+    time stamp t takes time proportional to the number of links at time t. The indices of the
+    most recently accessed time stamps are cached until the edge arrays change, so that
+    repeated lookups of the same time stamp are constant-time dictionary accesses."""
+
+    def __init__(self, ea, column, cache_size=64):
+        self.ea = ea
+        self.column = column
+        self.cache_size = cache_size
+        self._cache = {}
+        self._version = None
+
+    def __getitem__(self, t):
+        start, end = self.ea.timeRange(t)
+        if self._version != self.ea.version:
+            self._cache = {}
+            self._version = self.ea.version
+        index = self._cache.get(t)
+        if index is None:
+            index = {}
+            for e in self.ea.edges(start, end):
+                index.setdefault(e[self.column], []).append(e)
+            if len(self._cache) >= self.cache_size:
+                self._cache = {}
+            self._cache[t] = index
+        return index
+
+
+class ActivitiesView(Mapping):
+    """A read-only dictionary view storing, for each node v, the ordered array of
+    time stamps at which links (v,*;t) originate from v"""
+
+    def __init__(self, ea):
+        self.ea = ea
+
+    def __getitem__(self, v):
+        self.ea.flush()
+        i = self.ea.node_ids.get(v, -1)
+        if i < 0:
+            return self.ea.act_times[0:0]
+        return self.ea.act_times[self.ea.act_ptr[i]:self.ea.act_ptr[i+1]]
+
+    def __contains__(self, v):
+        return v in self.ea.node_ids
+
+    def __iter__(self):
+        return iter(list(self.ea.nodes))
+
+    def __len__(self):
+        return len(self.ea.nodes)
+
+
+def _deepSize(obj, seen):
+    """Returns the number of bytes occupied by a (nested) container, counting each object only once"""
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += _deepSize(k, seen) + _deepSize(v, seen)
+    elif isinstance(obj, (list, tuple, set)):
+        for x in obj:
+            size += _deepSize(x, seen)
+    return size
+
+
+def dictLayoutBytes(tedges, time, sources, targets, activities, activities_sets):
+    """Returns the number of bytes occupied by the dictionary-based index structures
+    of a TemporalNetwork instance. Node names are excluded, as they are needed in
+    any representation of the network."""
+    seen = set()
+    for e in tedges:
+        seen.add(id(e[0]))
+        seen.add(id(e[1]))
+    size = 0
+    for x in [tedges, time, sources, targets, activities, activities_sets]:
+        size += _deepSize(x, seen)
+    return size
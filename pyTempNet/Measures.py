@@ -6,6 +6,8 @@ Created on Thu Feb 19 11:49:39 2015
 (c) Copyright ETH Zürich, Chair of Systems Design, 2015
 """
 
+import multiprocessing
+import time
 import numpy as np
 import scipy.sparse as sparse
 import scipy.sparse.linalg as sla
@@ -31,15 +33,8 @@ def Laplacian(temporalnet, model="SECOND"):
     if (model is "SECOND" or "NULL") == False:
         raise ValueError("model must be one of \"SECOND\" or \"NULL\"")
     
-    if model == "SECOND":
-        network = temporalnet.igraphSecondOrder().components(mode="STRONG").giant()
-    elif model == "NULL": 
-        network = temporalnet.igraphSecondOrderNull().components(mode="STRONG").giant()  
-    
-    T2 = Utilities.RWTransitionMatrix( network )
-    I  = sparse.identity( len(network.vs()) )
-
-    return I-T2
+    # The Laplacian is cached by the temporal network
+    return temporalnet.getLaplacian(model)
 
 
 def FiedlerVectorSparse(temporalnet, model="SECOND", normalize=True, lanczosVecs=15, maxiter=10):
@@ -128,12 +123,7 @@ def AlgebraicConn(temporalnet, model="SECOND"):
     
     Log.add('Calculating algebraic connectivity ... ', Severity.INFO)
 
-    L = Laplacian(temporalnet, model)
-    # NOTE: ncv=13 sets additional auxiliary eigenvectors that are computed
-    # NOTE: in order to be more confident to find the one with the largest
-    # NOTE: magnitude, see
-    # NOTE: https://github.com/scipy/scipy/issues/4987
-    w = sla.eigs( L, which="SM", k=2, ncv=13, return_eigenvectors=False )
+    w = temporalnet.getLaplacianEigenvalues(model)
     evals_sorted = np.sort(np.absolute(w))
 
     Log.add('finished.', Severity.INFO)
@@ -150,23 +140,17 @@ def EntropyGrowthRateRatio(t, mode='FIRSTORDER'):
     # NOTE            EV of the transition matrix for the bigger of the
     # NOTE            two graphs below (either 2nd-order or 2nd-order null)
     
-    # Generate strongly connected component of second-order networks
-    g2 = t.igraphSecondOrder().components(mode="STRONG").giant()
-    
     if mode == 'FIRSTORDER':
-        g2n = t.igraphFirstOrder().components(mode="STRONG").giant()
+        model = 'FIRST'
     else:
-        g2n = t.igraphSecondOrderNull().components(mode="STRONG").giant()
+        model = 'NULL'
     
     Log.add('Calculating entropy growth rate ratio ... ', Severity.INFO)
 
-    # Calculate transition matrices
-    T2 = Utilities.RWTransitionMatrix(g2)
-    T2n = Utilities.RWTransitionMatrix(g2n)
-
-    # Compute entropy growth rates of transition matrices        
-    H2 = np.absolute(Utilities.EntropyGrowthRate(T2))
-    H2n = np.absolute(Utilities.EntropyGrowthRate(T2n))
+    # Compute entropy growth rates of (cached) transition matrices of 
+    # the strongly connected components of second-order networks
+    H2 = np.absolute(Utilities.EntropyGrowthRate(t.getTransitionMatrix('SECOND'), t.getStationaryDistribution('SECOND')))
+    H2n = np.absolute(Utilities.EntropyGrowthRate(t.getTransitionMatrix(model), t.getStationaryDistribution(model)))
 
     Log.add('finished.', Severity.INFO)
 
@@ -175,10 +159,64 @@ def EntropyGrowthRateRatio(t, mode='FIRSTORDER'):
 
 
 def BetweennessPreferences(t, normalized=False):
-    bwp = []
-    for v in t.igraphFirstOrder().vs()["name"]:
-        bwp.append(BetweennessPreference(t, v, normalized))
-    return np.array(bwp)
+    """Computes the betweenness preferences of all nodes in a temporal network t in a single pass 
+    over all two-paths. This function returns a numpy array of betweenness preferences, where the 
+    ordering corresponds to the vertex sequence of the first-order aggregate network. Rather than 
+    computing the betweenness preference matrix B_v of each node separately (see BetweennessPreference), 
+    the entries of all matrices are computed at once by grouping two-paths by their middle node, and 
+    mutual information is computed with vectorized entropy calculations.
+    
+    @param t: The temporalnetwork instance to work on
+    @param normalized: whether or not (default) to normalize
+    """
+    n = len(t.igraphFirstOrder().vs)
+    bwp = np.zeros(n)
+
+    s, v, d, w, time = t.twopaths.getOccurrences()
+    if len(s) == 0:
+        if normalized:
+            bwp.fill(np.nan)
+        return bwp
+
+    s = s.astype(np.int64)
+    v = v.astype(np.int64)
+    d = d.astype(np.int64)
+
+    # Each two-path (s,v,d) with first link at time t contributes 1/k to the entry (s,d) of B_v, 
+    # where k is the number of two-paths through v whose first link occurs at time t
+    time_rank = np.unique(time, return_inverse=True)[1].reshape(-1)
+    _, group, counts = np.unique(v * (time_rank.max() + 1) + time_rank, return_inverse=True, return_counts=True)
+    group = group.reshape(-1)
+
+    # Entries of all betweenness preference matrices, indexed by (v,s,d)
+    keys, entry = np.unique((v * n + s) * n + d, return_inverse=True)
+    entry = entry.reshape(-1)
+    B = np.bincount(entry, weights=1. / counts[group])
+    B_v = keys // (n * n)
+    B_s = keys // n % n
+    B_d = keys % n
+
+    # Normalize matrices (equation (3) of the paper)
+    S = np.bincount(B_v, weights=B, minlength=n)
+    P = B / S[B_v]
+
+    # Marginal probabilities P^v_s and P^v_d
+    keys_s, ix_s = np.unique(B_v * n + B_s, return_inverse=True)
+    keys_d, ix_d = np.unique(B_v * n + B_d, return_inverse=True)
+    ix_s = ix_s.reshape(-1)
+    ix_d = ix_d.reshape(-1)
+    marginal_s = np.bincount(ix_s, weights=P)
+    marginal_d = np.bincount(ix_d, weights=P)
+
+    bwp = np.bincount(B_v, weights=P * np.log2(P / (marginal_s[ix_s] * marginal_d[ix_d])), minlength=n)
+
+    if normalized:
+        H_s = np.bincount(keys_s // n, weights=-marginal_s * np.log2(marginal_s), minlength=n)
+        H_d = np.bincount(keys_d // n, weights=-marginal_d * np.log2(marginal_d), minlength=n)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bwp = bwp / np.minimum(H_s, H_d)
+
+    return bwp
 
 
 def BetweennessPreference(t, v, normalized = False):
@@ -241,24 +279,14 @@ def SlowDownFactor(t):
     #NOTE to myself: most of the time goes for construction of the 2nd order
     #NOTE            null graph, then for the 2nd order null transition matrix
     
-    g2 = t.igraphSecondOrder().components(mode="STRONG").giant()
-    g2n = t.igraphSecondOrderNull().components(mode="STRONG").giant()
-    
     Log.add('Calculating slow down factor ... ', Severity.INFO)
 
-    # Build transition matrices
-    T2 = Utilities.RWTransitionMatrix(g2)
-    T2n = Utilities.RWTransitionMatrix(g2n)
-    
-    # Compute eigenvector sequences
-    # NOTE: ncv=13 sets additional auxiliary eigenvectors that are computed
-    # NOTE: in order to be more confident to find the one with the largest
-    # NOTE: magnitude, see
-    # NOTE: https://github.com/scipy/scipy/issues/4987
-    w2 = sla.eigs(T2, which="LM", k=2, ncv=13, return_eigenvectors=False)
+    # Leading eigenvalues of the transition matrices of the strongly connected 
+    # components of second-order networks are cached by the temporal network
+    w2 = t.getLeadingEigenvalues('SECOND')
     evals2_sorted = np.sort(-np.absolute(w2))
 
-    w2n = sla.eigs(T2n, which="LM", k=2, ncv=13, return_eigenvectors=False)
+    w2n = t.getLeadingEigenvalues('NULL')
     evals2n_sorted = np.sort(-np.absolute(w2n))
 
     Log.add('finished.', Severity.INFO)
@@ -277,24 +305,14 @@ def EigenValueGap(t):
     #NOTE to myself: most of the time goes for construction of the 2nd order
     #NOTE            null graph, then for the 2nd order null transition matrix
     
-    g2 = t.igraphSecondOrder().components(mode="STRONG").giant()
-    g2n = t.igraphSecondOrderNull().components(mode="STRONG").giant()
-    
     Log.add('Calculating eigenvalue gap ... ', Severity.INFO)
 
-    # Build transition matrices
-    T2 = Utilities.RWTransitionMatrix(g2)
-    T2n = Utilities.RWTransitionMatrix(g2n)
-    
-    # Compute eigenvector sequences
-    # NOTE: ncv=13 sets additional auxiliary eigenvectors that are computed
-    # NOTE: in order to be more confident to find the one with the largest
-    # NOTE: magnitude, see
-    # NOTE: https://github.com/scipy/scipy/issues/4987
-    w2 = sla.eigs(T2, which="LM", k=2, ncv=13, return_eigenvectors=False)
+    # Leading eigenvalues of the transition matrices of the strongly connected 
+    # components of second-order networks are cached by the temporal network
+    w2 = t.getLeadingEigenvalues('SECOND')
     evals2_sorted = np.sort(-np.absolute(w2))
 
-    w2n = sla.eigs(T2n, which="LM", k=2, ncv=13, return_eigenvectors=False)
+    w2n = t.getLeadingEigenvalues('NULL')
     evals2n_sorted = np.sort(-np.absolute(w2n))
 
     Log.add('finished.', Severity.INFO)
@@ -313,8 +331,6 @@ def GetStaticEigenvectorCentrality(t, model='SECOND'):
     if (model is "SECOND" or "NULL") == False:
         raise ValueError("model must be one of \"SECOND\" or \"NULL\"")
 
-    name_map = Utilities.firstOrderNameMap(t)
-    
     if model == 'SECOND':
         g2 = t.igraphSecondOrder()
     else:
@@ -325,12 +341,7 @@ def GetStaticEigenvectorCentrality(t, model='SECOND'):
     evcent_2 = Utilities.StationaryDistribution( A, False )
     
     # Aggregate to obtain first-order eigenvector centrality
-    evcent_1 = np.zeros(len(name_map))
-    sep = t.separator
-    for i in range(len(evcent_2)):
-        # Get name of target node
-        target = g2.vs()[i]["name"].split(sep)[1]
-        evcent_1[name_map[target]] += np.real(evcent_2[i])
+    evcent_1 = t.projectionMatrix(g2, 'TARGET').dot(np.real(evcent_2))
     
     return np.real(evcent_1/sum(evcent_1))
 
@@ -348,8 +359,6 @@ def GetStaticPageRank(t, model='SECOND', projection='TARGET', normalization=Fals
     assert model is "SECOND" or model is "NULL"
     assert projection is 'TARGET' or projection is 'SOURCE'
 
-    name_map = Utilities.firstOrderNameMap( t )
-
     if model == 'SECOND':
         g2 = t.igraphSecondOrder()
     else:
@@ -359,67 +368,136 @@ def GetStaticPageRank(t, model='SECOND', projection='TARGET', normalization=Fals
     pagerank_2 = np.array(g2.pagerank(weights=g2.es()['weight'], directed=True))
     
     # Aggregate to obtain first-order pagerank centrality
-    pagerank_1 = np.zeros(len(name_map))
-    counts = np.array([1]*len(name_map))
-    sep = t.separator
-    for i in range(len(pagerank_2)):
-        # Get name of target node        
-        if projection == 'TARGET':
-            target = g2.vs()[i]["name"].split(sep)[1]
-            pagerank_1[name_map[target]] += pagerank_2[i]
-            counts[name_map[target]] +=1 
-        else:
-            source = g2.vs()[i]["name"].split(sep)[0]
-            pagerank_1[name_map[source]] += pagerank_2[i]
-            counts[name_map[source]] +=1 
+    P = t.projectionMatrix(g2, projection)
+    pagerank_1 = P.dot(pagerank_2)
     
     if normalization == True:
+        counts = 1 + np.asarray(P.sum(axis=1)).ravel()
         pagerank_1 = pagerank_1 / counts
     
     return pagerank_1
 
 
 
-def GetStaticBetweenness(t, model='SECOND'):
+def GetStaticBetweenness(t, model='SECOND', workers=1):
     """Computes betweenness centralities of nodes based on the second-order aggregate network, 
     and aggregates betweenness centralities to obtain the betweenness centrality of nodes in the 
-    first-order network.
+    first-order network. For each second-order node, the number of shortest paths passing through 
+    all other second-order nodes is accumulated in a single breadth-first search (in the spirit of 
+    Brandes' algorithm), where only shortest paths are counted whose length corresponds to the 
+    distance between the first-order source and target nodes (see Paths.GetSecondOrderDistanceMatrix).
     
     @param t: The temporalnetwork instance to work on
     @param model: either C{"SECOND"} or C{"NULL"}, where C{"SECOND"} is the 
       the default value.
+    @param workers: the number of worker processes among which the searches from 
+      different second-order nodes are distributed. This requires the fork start method, 
+      otherwise all searches run in the main process.
     """
 
     if (model is "SECOND" or "NULL") == False:
         raise ValueError("model must be one of \"SECOND\" or \"NULL\"")
 
+    if workers > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+        Log.add('Worker processes require the fork start method, running searches in a single process', Severity.WARNING)
+        workers = 1
+
     D = Paths.GetSecondOrderDistanceMatrix(t)
-    name_map = Utilities.firstOrderNameMap( t )
 
     if model == 'SECOND':
         g2 = t.igraphSecondOrder()
     else:
         g2 = t.igraphSecondOrderNull()
 
-    # Compute betweenness centrality based on second-order network
-    bwcent_1 = np.zeros(len(name_map))
-    sep = t.separator
-
-    for v in g2.vs()["name"]:
-        for w in g2.vs()["name"]:
-            s = v.split(sep)[0]
-            t = w.split(sep)[1]
-            X = g2.get_all_shortest_paths(v,w)
-            for p in X:
-                if D[name_map[s], name_map[t]] == len(p) and len(p) > 1:
-                    for i in range(len(p)):
-                        source = g2.vs()["name"][p[i]].split(sep)[0]
-                        if i>0:
-                            bwcent_1[name_map[source]] += 1 
+    A = Utilities.getSparseAdjacencyMatrix(g2)
+    source, target = t.secondOrderNodes(g2)
+    n = len(t.nodes)
+    roots = np.arange(g2.vcount())
+
+    if workers > 1 and len(roots) > 1:
+        context = multiprocessing.get_context('fork')
+        with context.Pool(workers, initializer=_initBetweennessWorker, initargs=(A, source, target, D, n)) as pool:
+            parts = pool.map(_betweennessWorker, np.array_split(roots, workers * 4))
+        return np.sum(parts, axis=0)
+
+    return _secondOrderBetweenness(A, source, target, D, n, roots)
+
+
+# Data shared with the processes of a worker pool (see GetStaticBetweenness)
+_shared = None
+
+
+def _initBetweennessWorker(A, source, target, D, n):
+    """Initializes a worker process with the shared second-order network"""
+    global _shared
+    _shared = (A, source, target, D, n)
+
+
+def _betweennessWorker(roots):
+    """Accumulates betweenness centralities for the given second-order root nodes"""
+    A, source, target, D, n = _shared
+    return _secondOrderBetweenness(A, source, target, D, n, roots)
+
+
+def _secondOrderBetweenness(A, source, target, D, n, roots):
+    """For each second-order root node v, counts the shortest paths from v to those second-order 
+    nodes w whose length matches the first-order distance D between the source of v and the target of w. 
+    Each such path contributes one to the betweenness of the source of every second-order node on the path 
+    except v. Returns an array of betweenness centralities of first-order nodes."""
+    bwcent_1 = np.zeros(n)
+    n2 = A.shape[0]
+    indptr = A.indptr
+    indices = A.indices
+
+    for v in roots:
+        dist = np.full(n2, -1, dtype=np.int64)
+        sigma = np.zeros(n2)
+        dist[v] = 0
+        sigma[v] = 1.
+
+        # Forward pass: breadth-first search counting the number of shortest paths sigma
+        levels = [(np.array([v]), None, None)]
+        frontier = levels[0][0]
+        d = 0
+        while len(frontier) > 0:
+            nb, owner = _expandNeighbors(indptr, indices, frontier)
+            mask = dist[nb] == -1
+            new, inv = np.unique(nb[mask], return_inverse=True)
+            dist[new] = d + 1
+            sigma[new] = np.bincount(inv.reshape(-1), weights=sigma[frontier[owner[mask]]], minlength=len(new))
+            levels[-1] = (frontier, nb, owner)
+            levels.append((new, None, None))
+            frontier = new
+            d += 1
+
+        # Second-order nodes w for which shortest paths from v have the length of the first-order distance
+        selected = (dist >= 1) & (dist + 1 == D[source[v], target])
+
+        # Backward pass: delta[x] counts the shortest paths from x to selected nodes in the 
+        # shortest path DAG, such that sigma[x]*delta[x] paths from v to selected nodes pass through x
+        delta = np.zeros(n2)
+        for d in range(len(levels) - 2, -1, -1):
+            X, nb, owner = levels[d]
+            mask = dist[nb] == d + 1
+            delta[X] = selected[X] + np.bincount(owner[mask], weights=delta[nb[mask]], minlength=len(X))
+
+        x = np.flatnonzero(dist >= 1)
+        bwcent_1 += np.bincount(source[x], weights=sigma[x] * delta[x], minlength=n)
+
     return bwcent_1
 
 
-def GetTemporalBetweenness(t, delta=1, normalized=False):
+def _expandNeighbors(indptr, indices, X):
+    """Returns the successors of all vertices X in a CSR adjacency matrix, as well as the 
+    position in X of the vertex each successor belongs to"""
+    starts = indptr[X]
+    lens = indptr[X + 1] - starts
+    total = lens.sum()
+    pos = np.repeat(starts - np.cumsum(lens) + lens, lens) + np.arange(total)
+    return indices[pos], np.repeat(np.arange(len(X)), lens)
+
+
+def GetTemporalBetweenness(t, delta=1, normalized=False, workers=1):
     """Calculates the temporal betweenness centralities of all nodes 
     in a temporal network t based on the shortest time-respecting paths with a 
     maximum waiting time of delta. This function returns a numpy array of temporal betweenness centrality values of 
@@ -433,25 +511,19 @@ def GetTemporalBetweenness(t, delta=1, normalized=False):
         by the class TemporalNetwork
     @param normalized: whether or not to normalize centralities by dividing each value byt the total number 
         of shortest time-respecting paths.
+    @param workers: the number of worker processes among which the searches from different 
+        source nodes are distributed
     """
 
-    bw = np.array([0]*len(t.nodes))
-    S = 0
+    D, S, bw = Paths._allSourcesSearch(t, None, delta, workers, betweenness=True)
 
-    name_map = Utilities.firstOrderNameMap(t)
-
-    minD, minPaths = Paths.GetMinTemporalDistance(t, delta=1, collect_paths=True)
-
-    for v in t.nodes:
-        for w in t.nodes:
-            for p in minPaths[v][w]:
-                for i in range(1,len(p)-1):
-                    bw[name_map[p[i][0]]] += 1
-                    S+=1
+    # Normalize by dividing by the total number of nodes on shortest time-respecting paths
+    if normalized:
+        bw = bw/bw.sum()
     return bw
 
 
-def GetTemporalBetweennessInstantaneous(t, start_t=0, delta=1, normalized=False):
+def GetTemporalBetweennessInstantaneous(t, start_t=-1, delta=1, normalized=False, workers=1):
     """Calculates the temporal betweennness values of 
     all nodes fir a given start time start_t in an empirical temporal network t.
     This function returns a numpy array of (temporal) betweenness centrality values. 
@@ -460,7 +532,7 @@ def GetTemporalBetweennessInstantaneous(t, start_t=0, delta=1, normalized=False)
     and array indices can be found in Utilities.firstOrderNameMap().
     
     @param t: the temporal network for which temporal betweenness centralities will be computed
-    @param start_t: the start time for which to consider time-respecting paths (default 0). This is 
+    @param start_t: the start time for which to consider time-respecting paths (default is t.ordered_times[0]). This is 
         important, since any unambigious definition of a shortest time-respecting path between
         two nodes must include the time range to be considered (c.f. Holme and Saramäki, Phys. Rep., 2012)
     @param delta: the maximum waiting time used in the time-respecting path definition (default 1)
@@ -468,29 +540,18 @@ def GetTemporalBetweennessInstantaneous(t, start_t=0, delta=1, normalized=False)
         by the class TemporalNetwork
     @param normalized: whether or not to normalize the temporal betweenness centrality values by
     dividing by the number of all shortest time-respecting paths in the temporal network.
+    @param workers: the number of worker processes among which the searches from different 
+        source nodes are distributed
     """
 
-    bw = np.array([0]*len(t.nodes))
-
-    # First calculate all shortest time-respecting paths starting at time start_t
-    D, paths = Paths.GetTemporalDistanceMatrix(t, start_t, delta, collect_paths=True)
+    if start_t == -1:
+        start_t = t.ordered_times[0]
 
-    # Get a mapping between node names and matrix indices
-    name_map = Utilities.firstOrderNameMap( t )
+    D, S, bw = Paths._allSourcesSearch(t, start_t, delta, workers, betweenness=True)
 
-    # Compute betweenness scores of all nodes based on shortest time-respecting paths
-    k=0
-    for u in t.nodes:
-        for v in t.nodes:
-            if u != v:
-                for p in paths[u][v]:
-                    for i in range(1, len(p)-1):
-                        bw[name_map[p[i][0]]] += 1
-                        k+=1
-
-    # Normalize by dividing by the total number of shortest time-respecting paths
+    # Normalize by dividing by the total number of nodes on shortest time-respecting paths
     if normalized:
-        bw = bw/k
+        bw = bw/bw.sum()
     return bw
 
 
@@ -502,25 +563,31 @@ def GetStaticCloseness(t, model='SECOND'):
       the default value.
     """
 
-    if model =='FIRST':
-        D = Paths.GetFirstOrderDistanceMatrix(t)
-    else:
-        D = Paths.GetSecondOrderDistanceMatrix(t, model)
-
-    name_map = Utilities.firstOrderNameMap( t )
-
-    closeness = np.zeros(len(name_map))
+    closeness = np.zeros(len(t.nodes))
 
     # Calculate closeness for each node u, by summing the reciprocal of its 
     # distances to all other nodes. Note that this definition of closeness centrality 
     # is required for directed networks that are not strongly connected. 
-    for u in t.nodes:
-        for v in t.nodes:
-            if u!=v:
-                closeness[name_map[u]] += 1./D[name_map[v], name_map[u]] 
+    # Distances are accumulated block by block, so the distance matrix is never stored.
+    if model =='FIRST':
+        Paths.GetFirstOrderDistanceMatrix(t, out=_closenessSink(closeness))
+    else:
+        Paths.GetSecondOrderDistanceMatrix(t, model, out=_closenessSink(closeness))
     return closeness
 
 
+def _closenessSink(closeness):
+    """Returns a function f(rows, D_rows) which adds the reciprocal distances from the 
+    nodes rows to all other nodes to the array closeness"""
+
+    def add(rows, D_rows):
+        with np.errstate(divide='ignore'):
+            R = 1./D_rows
+        R[np.arange(len(rows)), rows] = 0
+        closeness[:] += R.sum(axis=0)
+    return add
+
+
 def GetTemporalCloseness(t, delta=1):
     """Calculates the temporal closeness centralities of all nodes 
     in a temporal network t, based on the minimal shortest time-respecting paths with a 
@@ -538,18 +605,11 @@ def GetTemporalCloseness(t, delta=1):
 
     cl = np.array([0.]*len(t.nodes))
 
-    name_map = Utilities.firstOrderNameMap( t )
-
-    minD, minPaths = Paths.GetMinTemporalDistance(t, delta, collect_paths=False)
-
-    for u in t.nodes:
-        for v in t.nodes:
-            if u!= v:
-                cl[name_map[v]] += 1./minD[name_map[u], name_map[v]]
+    Paths.GetMinTemporalDistance(t, delta, collect_paths=False, out=_closenessSink(cl))
     return cl
 
 
-def GetTemporalClosenessInstantaneous(t, start_t=0, delta=1):
+def GetTemporalClosenessInstantaneous(t, start_t=0, delta=1, workers=1):
     """Calculates the temporal closeness values of 
     all nodes for a given start time start_t in a temporal network t.
     This function returns a numpy array of (temporal) closeness centrality values. 
@@ -564,27 +624,142 @@ def GetTemporalClosenessInstantaneous(t, start_t=0, delta=1):
     @param delta: the maximum time difference time used in the time-respecting path definition (default 1)
         Note that this parameter is independent from the delta used internally for the extraction of two-paths
         by the class TemporalNetwork.
+    @param workers: the number of worker processes among which the searches from different 
+        source nodes are distributed
     """
     
     closeness = np.array([0.]*len(t.nodes))
 
-    # Calculate all shortest time-respecting paths
-    D, paths = Paths.GetTemporalDistanceMatrix(t, start_t, delta, collect_paths=False)
-
-    # Get a mapping between node names and matrix indices
-    name_map = Utilities.firstOrderNameMap( t )
-
     # Calculate closeness for each node u, by summing the reciprocal of its 
-    # distances to all other nodes. Note that this definition of closeness centrality 
-    # is required for directed networks that are not strongly connected. 
-    for u in t.nodes:
-        for v in t.nodes:
-            if u!=v:
-                closeness[name_map[u]] += 1./D[name_map[v], name_map[u]]
+    # distances to all other nodes, where the distances of all shortest 
+    # time-respecting paths are accumulated block by block
+    Paths.GetTemporalDistanceMatrix(t, start_t, delta, collect_paths=False, workers=workers, out=_closenessSink(closeness))
 
     return closeness
 
 
+def GetTemporalClosenessSampled(t, delta=1, start_t=None, pivots=100, time_limit=None, seed=None):
+    """Approximates the temporal closeness centralities of all nodes based on the shortest 
+    time-respecting paths from a random sample of source nodes (pivots). Since the closeness 
+    of a node v sums the reciprocal distances from all other nodes, it is estimated by the 
+    scaled sum over the pivots. This function returns a tuple consisting of two numpy arrays 
+    holding the estimated closeness centralities and their standard errors. The ordering 
+    of values corresponds to the ordering of nodes in the vertex sequence of the igraph 
+    first order time-aggregated network.
+    
+    @param t: the temporal network for which temporal closeness centralities will be computed
+    @param delta: the maximum time difference used in the time-respecting path definition (default 1).
+        Note that this parameter is independent from the delta used internally for the extraction of two-paths
+        by the class TemporalNetwork
+    @param start_t: the start time for which to consider time-respecting paths. If start_t is None (default), 
+        time-respecting paths starting at any time are considered, as in GetTemporalCloseness. If start_t is C{"SAMPLE"}, 
+        a random start time is drawn for each pivot, so that the result estimates the values of 
+        GetTemporalClosenessInstantaneous averaged across all start times. 
+    @param pivots: the number of source nodes (or pairs of source nodes and start times) to be sampled, 
+        which must be at least one
+    @param time_limit: an optional time limit (in seconds), after which no further pivots are sampled
+    @param seed: an optional seed for the random number generator
+    """
+
+    closeness, bw, err_closeness, err_bw = _sampleTemporalSearches(t, delta, start_t, pivots, time_limit, seed)
+    return closeness, err_closeness
+
+
+def GetTemporalBetweennessSampled(t, delta=1, start_t=None, pivots=100, time_limit=None, seed=None, normalized=False):
+    """Approximates the temporal betweenness centralities of all nodes based on the shortest 
+    time-respecting paths from a random sample of source nodes (pivots). Since the betweenness 
+    of a node v sums the number of shortest paths passing through v from all sources, it is 
+    estimated by the scaled sum over the pivots. This function returns a tuple consisting of 
+    two numpy arrays holding the estimated betweenness centralities and their standard errors. 
+    The ordering of values corresponds to the ordering of nodes in the vertex sequence of the 
+    igraph first order time-aggregated network.
+    
+    @param t: the temporal network for which temporal betweenness centralities will be computed
+    @param delta: the maximum time difference used in the time-respecting path definition (default 1).
+        Note that this parameter is independent from the delta used internally for the extraction of two-paths
+        by the class TemporalNetwork
+    @param start_t: the start time for which to consider time-respecting paths. If start_t is None (default), 
+        time-respecting paths starting at any time are considered, as in GetTemporalBetweenness. If start_t is C{"SAMPLE"}, 
+        a random start time is drawn for each pivot, so that the result estimates the values of 
+        GetTemporalBetweennessInstantaneous averaged across all start times. 
+    @param pivots: the number of source nodes (or pairs of source nodes and start times) to be sampled, 
+        which must be at least one
+    @param time_limit: an optional time limit (in seconds), after which no further pivots are sampled
+    @param seed: an optional seed for the random number generator
+    @param normalized: whether or not to normalize the estimated centralities (and their errors) by 
+        the estimated total number of nodes on shortest time-respecting paths.
+    """
+
+    closeness, bw, err_closeness, err_bw = _sampleTemporalSearches(t, delta, start_t, pivots, time_limit, seed)
+    if normalized:
+        total = bw.sum()
+        bw = bw/total
+        err_bw = err_bw/total
+    return bw, err_bw
+
+
+def _sampleTemporalSearches(t, delta, start_t, pivots, time_limit, seed):
+    """Runs searches for shortest time-respecting paths from randomly sampled pivots and returns 
+    the estimated closeness and betweenness centralities, as well as their standard errors. If 
+    start_t is C{"SAMPLE"}, pairs of source nodes and start times are drawn with replacement, 
+    otherwise source nodes are drawn without replacement. In the latter case, standard errors 
+    include the finite population correction, so they vanish if all nodes are sampled.
+    """
+
+    if pivots < 1:
+        raise ValueError("pivots must be at least one")
+    if len(t.nodes) == 0:
+        raise ValueError("temporal network does not contain any nodes")
+
+    rng = np.random.RandomState(seed)
+    n = len(t.nodes)
+    index = Paths._temporalIndex(t, delta)
+
+    if start_t == 'SAMPLE':
+        sources = rng.randint(n, size=pivots)
+        start_times = [t.ordered_times[i] for i in rng.randint(len(t.ordered_times), size=pivots)]
+    else:
+        if start_t == -1:
+            start_t = t.ordered_times[0]
+        sources = rng.permutation(n)[:pivots]
+        start_times = [start_t] * len(sources)
+
+    Log.add('Sampling shortest time-respecting paths from ' + str(len(sources)) + ' pivots ...')
+
+    # Sum and sum of squares of the contributions of pivots to closeness (row 0) and betweenness (row 1)
+    sums = np.zeros(shape=(2,n))
+    squares = np.zeros(shape=(2,n))
+    D = np.zeros(shape=(1,n))
+    k = 0
+    start = time.time()
+    for v, st in zip(sources, start_times):
+        if time_limit is not None and k > 0 and time.time() - start > time_limit:
+            break
+        x = np.zeros(shape=(2,n))
+        x[1] = Paths._searchRows(index, [v], st, D, None, True)
+        with np.errstate(divide='ignore'):
+            x[0] = 1./D[0]
+        x[0,v] = 0
+        sums += x
+        squares += x**2
+        k += 1
+
+    # The sum across all n sources is estimated by n times the mean contribution of pivots
+    mean = sums/k
+    estimate = n * mean
+    if k > 1:
+        variance = np.maximum(squares/k - mean**2, 0) * k/(k-1)
+        error = n * np.sqrt(variance/k)
+        if start_t != 'SAMPLE':
+            error *= np.sqrt((n-k)/float(n-1))
+    else:
+        error = np.zeros(shape=(2,n))
+        error.fill(np.inf)
+
+    Log.add('finished, sampled ' + str(k) + ' pivots.')
+    return estimate[0], estimate[1], error[0], error[1]
+
+
 def WeightedKCore( t, alpha, beta ):
     """ TODO: write a nice docstring here
     
@@ -593,15 +768,13 @@ def WeightedKCore( t, alpha, beta ):
     @param beta: TODO
     """
     
-    # work on second order network
-    g = t.g2
+    # work on a copy of the second order network, since weights are rescaled 
+    # and vertices are deleted below
+    g = t.igraphSecondOrder().copy()
     
     # check that 'weight' is in attribute list of edges
     if( 'weight' not in g.es.attribute_names() ):
           raise ValueError( "Attribute \"weight\" does not exist." )
-    # check that 'names' is in attribute list of vertices
-    if( 'name' not in g.vs.attribute_names() ):
-          raise ValueError( "Attribute \"name\" is not defined." )
     
     
     #-- Calculation of the Weighted k-shell structure (for the whole network)
@@ -612,7 +785,7 @@ def WeightedKCore( t, alpha, beta ):
     g.es()["weight"] = np.round( (edge_weights/meandegree)/mm )
     
     #-- extract names and degrees
-    names = g.vs()['name']
+    names = t.secondOrderNames(g)
     degrees = g.degree()
     # NOTE: be sure to use the right weights
     weights = g.strength( weights='weight' )    
@@ -635,11 +808,12 @@ def WeightedKCore( t, alpha, beta ):
             # go backwards through the index array
             for i in range( len(ind)-1, -1, -1 ):
                 index = ind[i]
-                nn = g.vs()['name'][index]
+                nn = names[index]
                 resultShell[xx] = kval
                 resultName.append(nn)
                 xx += 1
             g.delete_vertices( ind )
+            names = np.delete( names, ind ).tolist()
             
             if len(g.vs()) > 0:
                 degrees = g.degree()
@@ -678,34 +852,29 @@ def DetectTemporalCommunities( t, projection="TARGET", method="INFOMAP"):
     first = t.igraphFirstOrder()
     second = t.igraphSecondOrder()
 
-    membership_counts = defaultdict(lambda: defaultdict( lambda: 0))
-
-    # Initialize membership vector 
-    membership_1 = [0]*first.vcount()
-    
     if method == "INFOMAP":
         clusters = second.community_infomap()
     else:
         raise Exception("Unsupported community detection method")
-    
-    for i in range(second.vcount()):
-        v_2 = second.vs[i]['name'].split(t.separator)
-        v_1_id = first.vs.find(name=v_2[0]).index
-        w_1_id = first.vs.find(name=v_2[1]).index
-        if projection == "SOURCE":
-            membership_counts[v_1_id][clusters.membership[i]] = membership_counts[v_1_id][clusters.membership[i]] + 1
-            #membership_1[v_1_id] = clusters.membership[i]
-        else:
-            membership_counts[w_1_id][clusters.membership[i]] = membership_counts[w_1_id][clusters.membership[i]] + 1
-            #membership_1[w_1_id] = clusters.membership[i]
-
-    for i in range(first.vcount()):
-        counts = list(membership_counts[i].values())
-        communities = list(membership_counts[i].keys())
-        if len(counts)>0:
-            membership_1[i] = communities[counts.index(max(counts))]+1
-        else:
-            membership_1[i] = 0
+
+    # Project community memberships of second-order nodes to the sources or targets of 
+    # the corresponding first-order links, and count the memberships of each first-order node
+    source, target = t.secondOrderNodes(second)
+    nodes = source if projection == "SOURCE" else target
+    membership = np.array(clusters.membership, dtype=np.int64)
+    k = np.int64(membership.max() + 1) if len(membership) > 0 else np.int64(1)
+    keys, first_index, counts = np.unique(nodes * k + membership, return_index=True, return_counts=True)
+    nodes = keys // k
+
+    # For each first-order node, choose the most frequent community, where ties are 
+    # resolved in favor of the community which occurs first in the second-order network
+    order = np.lexsort((first_index, -counts, nodes))
+    best = order[np.concatenate(([True], nodes[order][1:] != nodes[order][:-1]))]
+
+    # Initialize membership vector, where nodes without second-order nodes are assigned to community 0
+    membership_1 = np.zeros(first.vcount(), dtype=np.int64)
+    membership_1[nodes[best]] = keys[best] % k + 1
+    membership_1 = membership_1.tolist()
 
 
     return membership_1
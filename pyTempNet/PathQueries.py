@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Queries for single time-respecting paths between pairs of nodes (earliest
+arrival, latest departure and fastest paths) based on a prebuilt link index.
+"""
+
+import heapq
+import numpy as np
+
+from bisect import bisect_left
+from bisect import bisect_right
+
+from pyTempNet.Log import *
+
+
+class TemporalPathIndex:
+    """An index of the time-stamped links of a temporal network which supports queries for
+    single time-respecting paths (see GetEarliestArrival, GetLatestDeparture and GetFastestPath).
+    For each pair of nodes (v,w), the time stamps of all links (v,w;ts) are stored in sorted order,
+    so that the first or last link between two nodes within a time range can be found by binary
+    search. Generating the index once and passing it to repeated queries avoids touching any
+    links which are not visited by the search. Note that the index does not reflect links which
+    are added to the temporal network later on."""
+
+    def __init__(self, t):
+        """Generates an index for a given temporal network
+
+        @param t: the temporal network to generate the index for
+        """
+        ea = t.getEdgeArrays()
+
+        # The list of node names and a mapping between node names and integer ids
+        self.nodes = list(t.nodes)
+        self.node_ids = {}
+        for i in range(len(self.nodes)):
+            self.node_ids[self.nodes[i]] = i
+
+        # For each node v, a list of tuples (w, start, end), where the sorted time stamps of
+        # all links (v,w;ts) are stored at positions [start, end) of out_times
+        self.out_neighbors, self.out_times = self._groupLinks(ea.src, ea.dst, ea.times)
+
+        # For each node w, a list of tuples (v, start, end), where the sorted time stamps of
+        # all links (v,w;ts) are stored at positions [start, end) of in_times
+        self.in_neighbors, self.in_times = self._groupLinks(ea.dst, ea.src, ea.times)
+
+        # The sorted, unique time stamps at which node v is the source of a link
+        self.activities = [ea.act_times[ea.act_ptr[v]:ea.act_ptr[v+1]].tolist() for v in range(len(self.nodes))]
+
+
+    def _groupLinks(self, u, v, times):
+        """Groups links by pairs of nodes (u,v) and returns, for each node u, the list of
+        tuples (v, start, end) along with the list of time stamps sorted within each group"""
+        neighbors = [[] for i in range(len(self.nodes))]
+        if len(u) == 0:
+            return neighbors, []
+        order = np.lexsort((times, v, u))
+        u = u[order]
+        v = v[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+        starts = np.flatnonzero(first)
+        ends = np.append(starts[1:], len(order))
+        for x, y, start, end in zip(u[starts].tolist(), v[starts].tolist(), starts.tolist(), ends.tolist()):
+            neighbors[x].append((y, start, end))
+        return neighbors, times[order].tolist()
+
+
+    def path(self, pred, state):
+        """Returns the path leading to a state (v,ts) of a search, as a list of pairs (node, time)"""
+        path = []
+        while state is not None:
+            path.append((self.nodes[state[0]], state[1]))
+            state = pred[state]
+        path.reverse()
+        return path
+
+
+def GetEarliestArrival(t, source, target=None, start_t=-1, delta=None, end_t=None, index=None):
+    """Computes the earliest time at which a time-respecting path starting in node source at time
+    start_t (or later) arrives in node target, where a path using a link (v,w;ts) arrives in w at time
+    ts+1. Nodes are visited in the order of their arrival times, and the search terminates as soon
+    as target is reached. If a target node is given, this function returns a tuple consisting of the
+    earliest arrival time (np.inf if target cannot be reached) and the corresponding path as a list
+    of pairs (node, arrival time), starting with (source, start_t). Otherwise, it returns a numpy array
+    of the earliest arrival times of all nodes (including source itself), where the ordering of values
+    corresponds to the ordering of nodes in the vertex sequence of the igraph first order time-aggregated network.
+
+    @param t: the temporal network to query
+    @param source: the name of the source node
+    @param target: the name of the target node. If None, arrival times of all nodes are computed.
+    @param start_t: the start time of paths (default is t.ordered_times[0])
+    @param delta: the maximum waiting time in the time-respecting path definition, i.e. a path arriving in
+        v at time ts can be continued by links (v,*;ts') with ts <= ts' < ts+delta. Note that this also
+        applies to the first link of a path. If None (default), waiting times are not limited.
+    @param end_t: an optional time after which the search is terminated, i.e. later arrivals are ignored
+    @param index: an optional TemporalPathIndex of t, which should be passed for repeated queries
+    """
+
+    if index is None:
+        index = TemporalPathIndex(t)
+    if start_t == -1:
+        start_t = t.ordered_times[0]
+
+    s = index.node_ids[source]
+    w = index.node_ids[target] if target is not None else -1
+    arrival, state, pred = _earliestArrival(index, s, start_t, delta, w, end_t)
+
+    if target is None:
+        return np.array(arrival, dtype=float)
+    if state is None:
+        return np.inf, []
+    return arrival[w], index.path(pred, state)
+
+
+def GetLatestDeparture(t, source, target, end_t=None, delta=None, index=None):
+    """Computes the latest time at which a time-respecting path can leave node source such that
+    it arrives in node target no later than end_t, where a path using a link (v,w;ts) arrives in w at
+    time ts+1. Nodes are visited in reverse order of their departure times, and the search terminates
+    as soon as source is reached. This function returns a tuple consisting of the latest departure
+    time (-np.inf if no such path exists) and the corresponding path as a list of pairs (node, time),
+    starting with (source, departure time) followed by the arrival times of all other nodes.
+
+    @param t: the temporal network to query
+    @param source: the name of the source node
+    @param target: the name of the target node
+    @param end_t: the time by which paths must arrive in target (default is one after the last time stamp)
+    @param delta: the maximum waiting time in the time-respecting path definition, i.e. a path arriving in
+        v at time ts can be continued by links (v,*;ts') with ts <= ts' < ts+delta. If None (default),
+        waiting times are not limited.
+    @param index: an optional TemporalPathIndex of t, which should be passed for repeated queries
+    """
+
+    if index is None:
+        index = TemporalPathIndex(t)
+    if end_t is None:
+        end_t = t.ordered_times[-1] + 1
+
+    s = index.node_ids[source]
+    w = index.node_ids[target]
+    if s == w:
+        return end_t, [(source, end_t)]
+
+    if delta is None:
+        return _latestDeparture(index, s, w, end_t)
+    return _latestDepartureDelta(index, s, w, end_t, delta)
+
+
+def GetFastestPath(t, source, target, start_t=-1, end_t=None, delta=None, index=None):
+    """Computes the time-respecting path from node source to node target with minimal duration, i.e.
+    the minimal difference between the arrival time in target and the time stamp of the first link.
+    For each time at which source is active (in ascending order), the earliest arrival in target
+    is computed, where the search terminates as soon as the duration exceeds that of the fastest path
+    found so far. This function returns a tuple consisting of the minimal duration (np.inf if target
+    cannot be reached) and the corresponding path as a list of pairs (node, time), starting with
+    (source, departure time) followed by the arrival times of all other nodes.
+
+    @param t: the temporal network to query
+    @param source: the name of the source node
+    @param target: the name of the target node
+    @param start_t: the earliest time at which paths may leave source (default is t.ordered_times[0])
+    @param end_t: an optional time by which paths must arrive in target
+    @param delta: the maximum waiting time in the time-respecting path definition. If None (default),
+        waiting times are not limited.
+    @param index: an optional TemporalPathIndex of t, which should be passed for repeated queries
+    """
+
+    if index is None:
+        index = TemporalPathIndex(t)
+    if start_t == -1:
+        start_t = t.ordered_times[0]
+
+    s = index.node_ids[source]
+    w = index.node_ids[target]
+    if s == w:
+        return 0, [(source, start_t)]
+
+    best = np.inf
+    best_path = []
+    activities = index.activities[s]
+    for i in range(bisect_left(activities, start_t), len(activities)):
+        d = activities[i]
+        if end_t is not None and d + 1 > end_t:
+            break
+        arrival, state, pred = _earliestArrival(index, s, d, delta, w, end_t, bound=d + best, first_link=d)
+        if state is not None:
+            best = arrival[w] - d
+            best_path = index.path(pred, state)
+            # No path can be faster than a single link
+            if best == 1:
+                break
+    return best, best_path
+
+
+def _earliestArrival(index, s, start_t, delta, target=-1, end_t=None, bound=None, first_link=None):
+    """Dijkstra-style search for earliest arrival times of time-respecting paths starting in node s
+    at time start_t. States of the search are pairs (v,ts) of a node v and an arrival time ts. Without
+    a maximum waiting time delta, only the earliest arrival in each node needs to be expanded, while
+    all states are expanded otherwise. The search terminates when target is reached, or when the arrival
+    time exceeds end_t or reaches bound. If first_link is given, paths must start with a link at this time.
+    Returns the list of earliest arrival times of all nodes, the state in which target has been reached
+    (or None) and a dictionary of predecessor states."""
+
+    out_neighbors = index.out_neighbors
+    times = index.out_times
+
+    arrival = [np.inf] * len(index.nodes)
+    arrival[s] = start_t
+    root = (s, start_t)
+    pred = {root: None}
+    heap = [(start_t, s)]
+
+    while len(heap) > 0:
+        a, x = heapq.heappop(heap)
+        if (end_t is not None and a > end_t) or (bound is not None and a >= bound):
+            break
+        if delta is None and a > arrival[x]:
+            continue
+        if x == target:
+            return arrival, (x, a), pred
+
+        for (y, start, end) in out_neighbors[x]:
+            if first_link is not None and (x, a) == root:
+                lo = bisect_left(times, first_link, start, end)
+                hi = bisect_right(times, first_link, start, end)
+            elif delta is None:
+                lo = bisect_left(times, a, start, end)
+                hi = min(lo + 1, end)
+            else:
+                lo = bisect_left(times, a, start, end)
+                hi = bisect_left(times, a + delta, start, end)
+            for k in range(lo, hi):
+                b = times[k] + 1
+                if delta is None and b >= arrival[y]:
+                    break
+                if (y, b) in pred:
+                    continue
+                pred[(y, b)] = (x, a)
+                if b < arrival[y]:
+                    arrival[y] = b
+                heapq.heappush(heap, (b, y))
+    return arrival, None, pred
+
+
+def _latestDeparture(index, s, w, end_t):
+    """Reverse Dijkstra-style search for the latest departure from node s such that w is reached by
+    time end_t, without limiting waiting times. For each node v, only the latest time at which a
+    path can leave v needs to be expanded."""
+
+    in_neighbors = index.in_neighbors
+    times = index.in_times
+
+    # Latest time by which each node must be reached, and the link (w,ts) by which it is left
+    latest = [-np.inf] * len(index.nodes)
+    latest[w] = end_t
+    succ = {}
+    heap = [(-end_t, w)]
+
+    while len(heap) > 0:
+        l, y = heapq.heappop(heap)
+        l = -l
+        if l < latest[y]:
+            continue
+        if y == s:
+            # Follow the links by which nodes are left
+            path = [(index.nodes[s], l)]
+            x = s
+            while x != w:
+                x, ts = succ[x]
+                path.append((index.nodes[x], ts + 1))
+            return l, path
+
+        for (x, start, end) in in_neighbors[y]:
+            # The last link (x,y;ts) with ts+1 <= l
+            k = bisect_right(times, l - 1, start, end) - 1
+            if k >= start and times[k] > latest[x]:
+                latest[x] = times[k]
+                succ[x] = (y, times[k])
+                heapq.heappush(heap, (-times[k], x))
+    return -np.inf, []
+
+
+def _latestDepartureDelta(index, s, w, end_t, delta):
+    """Reverse Dijkstra-style search for the latest departure from node s such that w is reached by
+    time end_t, with a maximum waiting time delta. States of the search are pairs (v,ts), where a link
+    (v,*;ts) can be used by a path reaching w by end_t."""
+
+    in_neighbors = index.in_neighbors
+    times = index.in_times
+
+    # Maps each state (v,ts) to the subsequent state of the path, or None at the end of the path
+    succ = {}
+    heap = []
+    for (x, start, end) in in_neighbors[w]:
+        for k in range(start, bisect_right(times, end_t - 1, start, end)):
+            if (x, times[k]) not in succ:
+                succ[(x, times[k])] = (w, None)
+                heapq.heappush(heap, (-times[k], x))
+
+    while len(heap) > 0:
+        ts, y = heapq.heappop(heap)
+        ts = -ts
+        if y == s:
+            path = [(index.nodes[s], ts)]
+            state = (s, ts)
+            while state[0] != w:
+                next_state = succ[state]
+                path.append((index.nodes[next_state[0]], state[1] + 1))
+                state = next_state
+            return ts, path
+
+        for (x, start, end) in in_neighbors[y]:
+            # Links (x,y;ts') with ts'+1 <= ts < ts'+1+delta
+            lo = bisect_right(times, ts - 1 - delta, start, end)
+            hi = bisect_right(times, ts - 1, start, end)
+            for k in range(lo, hi):
+                if (x, times[k]) not in succ:
+                    succ[(x, times[k])] = (y, ts)
+                    heapq.heappush(heap, (-times[k], x))
+    return -np.inf, []
@@ -6,11 +6,13 @@ Created on Thu Aug 18 17:28:39 2015
 (c) Copyright ETH Zürich, Chair of Systems Design, 2015
 """
 
+import multiprocessing
 import numpy as np
 import scipy.sparse as sparse
 import scipy.sparse.linalg as sla
 
 from collections import defaultdict
+from collections import deque
 
 from bisect import bisect_left
 from bisect import bisect_right
@@ -19,7 +21,7 @@ from pyTempNet import Utilities
 from pyTempNet.Log import *
 
 
-def GetFirstOrderDistanceMatrix(t):        
+def GetFirstOrderDistanceMatrix(t, out=None):        
     """Calculates a matrix D containing the shortest path lengths between all
     pairs of nodes calculated based on the topology of the *first-order* aggregate network. 
     The ordering of rows/columns corresponds to the ordering of nodes in the vertex sequence of 
@@ -28,29 +30,34 @@ def GetFirstOrderDistanceMatrix(t):
     
     @param t: the temporal network to calculate shortest path lengths for based on a first-order
         aggregate representation    
+    @param out: an optional destination to which D is written in blocks of rows, rather than allocating 
+        a dense matrix. This can either be an array of shape (n,n), e.g. a np.memmap, or a function f(rows, D_rows) 
+        which is called for each block of rows. Arrays of an integer type such as np.uint16 store unreachable 
+        pairs as the maximum value of this type. If out is a function, None is returned instead of D.
     """   
 
     # This way of generating the first-order time-aggregated network makes sure that 
     # links are not omitted even if they do not contribute to any time-respecting path
     g1 = t.igraphFirstOrder(all_links=False, force=True)
 
-    name_map = Utilities.firstOrderNameMap( t )
-
-    D = np.zeros(shape=(len(t.nodes),len(t.nodes)))
-    D.fill(np.inf)
-    np.fill_diagonal(D, 0)
-
-    for v in g1.vs()["name"]:
-        for w in g1.vs()["name"]:
-            # Compute all shortest paths using igraph
-            X = g1.get_shortest_paths(v,w)
-            for p in X:
-                if len(p)>0:
-                    D[name_map[v], name_map[w]] = len(p)-1
+    n = len(t.nodes)
+    D, write = _rowWriter(out, n)
+
+    # A single breadth-first search per source yields the distances to all other nodes
+    block = _blockRows(n)
+    for start in range(0, n, block):
+        rows = np.arange(start, min(start+block, n))
+        D_rows = np.zeros(shape=(len(rows),n))
+        D_rows.fill(np.inf)
+        D_rows[np.arange(len(rows)), rows] = 0
+        sources = rows[rows < g1.vcount()]
+        if len(sources) > 0:
+            D_rows[:len(sources), :g1.vcount()] = np.array(g1.distances(source=sources.tolist(), mode='out'), dtype=float)
+        write(rows, D_rows)
     return D
 
 
-def GetSecondOrderDistanceMatrix(t, model='SECOND'):
+def GetSecondOrderDistanceMatrix(t, model='SECOND', out=None):
     """Calculates a matrix D containing the shortest path lengths between all
     pairs of nodes calculated based on the topology of the *second-order* aggregate network. 
     The ordering of rows/columns corresponds to the ordering of nodes in the vertex sequence of 
@@ -61,36 +68,64 @@ def GetSecondOrderDistanceMatrix(t, model='SECOND'):
         aggregate representation 
     @param model: either C{"SECOND"} or C{"NULL"}, where C{"SECOND"} is the 
       the default value.   
+    @param out: an optional destination to which D is written in blocks of rows, rather than allocating 
+        a dense matrix. This can either be an array of shape (n,n), e.g. a np.memmap, or a function f(rows, D_rows) 
+        which is called for each block of rows. Arrays of an integer type such as np.uint16 store unreachable 
+        pairs as the maximum value of this type. If out is a function, None is returned instead of D.
     """   
 
     if (model is "SECOND" or "NULL") == False:
         raise ValueError("model must be one of \"SECOND\" or \"NULL\"")
 
-    name_map = Utilities.firstOrderNameMap( t )
-
     if model == 'SECOND':
         g2 = t.igraphSecondOrder()
     else:
         g2 = t.igraphSecondOrderNull()    
 
-    D = np.zeros(shape=(len(t.nodes),len(t.nodes)))
-    D.fill(np.inf)
-    np.fill_diagonal(D, 0)
-
-    sep = t.separator
-
-    for v in g2.vs()["name"]:
-        source = v.split(sep)[0]
-        for w in g2.vs()["name"]:
-            target = w.split(sep)[1]
-            X = g2.get_shortest_paths(v,w)            
-            for p in X:
-                if len(p)>0:
-                    D[name_map[source], name_map[target]] = min(len(p), D[name_map[source], name_map[target]])
+    n = len(t.nodes)
+    D, write = _rowWriter(out, n)
+
+    sources, targets = t.secondOrderNodes(g2)
+    n2 = g2.vcount()
+
+    # Sort second-order nodes by their target, so that the minimum over all second-order 
+    # nodes with a common first-order target can be taken with a single reduceat
+    order = np.argsort(targets, kind='mergesort')
+    first_order_targets, starts = np.unique(targets[order], return_index=True)
+
+    # Second-order nodes with first-order source v are by_source[source_ptr[v]:source_ptr[v+1]]
+    by_source = np.argsort(sources, kind='mergesort')
+    source_ptr = np.zeros(n+1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n), out=source_ptr[1:])
+
+    # A single breadth-first search per second-order source yields the distances 
+    # to all other second-order nodes. First-order sources are processed in blocks 
+    # to limit the size of the intermediate distance matrix
+    block = _blockRows(max(n, n2))
+    for start in range(0, n, block):
+        rows = np.arange(start, min(start+block, n))
+        D_rows = np.zeros(shape=(len(rows),n))
+        D_rows.fill(np.inf)
+        D_rows[np.arange(len(rows)), rows] = 0
+
+        nodes = by_source[source_ptr[rows[0]]:source_ptr[rows[-1]+1]]
+        if len(nodes) > 0:
+            R = np.array(g2.distances(source=nodes.tolist(), mode='out'), dtype=float)
+
+            # A path of length k in the second-order network corresponds to a 
+            # path of length k+1 in the first-order network
+            R = np.minimum.reduceat(R[:, order], starts, axis=1) + 1
+
+            # Minimum over all second-order nodes with a common first-order source
+            M = np.zeros(shape=(len(rows), len(first_order_targets)))
+            M.fill(np.inf)
+            np.minimum.at(M, sources[nodes] - start, R)
+            D_rows[:, first_order_targets] = np.minimum(D_rows[:, first_order_targets], M)
+        write(rows, D_rows)
     return D
 
 
-def GetMinTemporalDistance(t, delta=1, collect_paths=True):
+def GetMinTemporalDistance(t, delta=1, collect_paths=True, out=None):
     """ Computes the minimum temporal distance between all pairs of nodes in 
         terms of time-respecting paths (using a given maximum time difference delta), 
         across all possible starting times in the temporal network
@@ -99,12 +134,38 @@ def GetMinTemporalDistance(t, delta=1, collect_paths=True):
         @param delta: the maximum waiting time to be used for the definition of time-respecting paths.
             Note that this is independent of the delta parameter set in the temporal networks instancd
            for the two-path extraction
-        @param collect_paths: whether or not to return all shortest time-respecting paths. If False, only 
-            shortest path distances will be returned.
+        @param collect_paths: whether or not to return all shortest time-respecting paths (default True). 
+            Note that the default is the slow method: paths are collected by a separate search for each 
+            time stamp, whose cost grows with the number of time stamps and with the (possibly exponential) 
+            number of shortest paths. If False, only shortest path distances will be returned, which are 
+            computed in a single reverse-time sweep over all time-stamped links (see _minTemporalDistanceSweep). 
+            Callers which do not need the paths should therefore set collect_paths=False.
+        @param out: an optional destination to which minD is written in blocks of rows, rather than allocating 
+            a dense matrix. This can either be an array of shape (n,n), e.g. a np.memmap, or a function f(rows, D_rows) 
+            which is called for each block of rows. Arrays of an integer type such as np.uint16 store unreachable 
+            pairs as the maximum value of this type. If out is a function, None is returned instead of minD. 
+            Note that each block of rows requires a separate sweep over all links.
     """
 
     Log.add('Computing minimum temporal distances for delta = ' + str(int(delta)) + ' ...')
 
+    if collect_paths == False:
+        n = len(t.nodes)
+        minD, write = _rowWriter(out, n)
+
+        # Distances from a block of source nodes are computed as distances to these 
+        # nodes in the time-reversed network, in which links (v,w;ts) are replaced 
+        # by (w,v;-ts)
+        ea = t.getEdgeArrays()
+        src, dst, times = ea.dst[::-1], ea.src[::-1], -ea.times[::-1]
+
+        block = n if out is None else _blockRows(n)
+        for start in range(0, n, max(block, 1)):
+            rows = np.arange(start, min(start+block, n))
+            write(rows, _minTemporalDistanceSweep(src, dst, times, n, delta, rows).T)
+        Log.add('finished.')
+        return minD, defaultdict( lambda: defaultdict( lambda: [] ) )
+
     name_map = Utilities.firstOrderNameMap( t )
 
     minD = np.zeros(shape=(len(t.nodes),len(t.nodes)))
@@ -126,11 +187,88 @@ def GetMinTemporalDistance(t, delta=1, collect_paths=True):
                     for p in paths[v][w]:
                         if p not in minPaths[v][w]:
                             minPaths[v][w] = minPaths[v][w] + [p]
+    if out is not None:
+        write = _rowWriter(out, len(t.nodes))[1]
+        write(np.arange(len(t.nodes)), minD)
+        minD = out if not callable(out) else None
     Log.add('finished.')
     return minD, minPaths
 
 
-def GetTemporalDistanceMatrix(t, start_t=-1, delta=1, collect_paths=True):
+def _minTemporalDistanceSweep(src, dst, times, n, delta, cols):
+    """Computes the minimum length of time-respecting paths from all nodes to the nodes 
+    cols, across all possible starting times, in a single sweep over time-stamped links in 
+    reverse time order. For each pair (v,ts) of a node and a time stamp at which v is 
+    the source of a link, a vector H[v,ts] holds the minimum length of time-respecting 
+    paths to the nodes cols that start with a link (v,*;ts). For a link (v,w;ts), these lengths 
+    follow from the minima H[w,ts'] over the time window ts+1 <= ts' < ts+1+delta, in 
+    which time-respecting paths can be continued at w. Vectors which have left this time 
+    window are discarded, so memory is bounded by the number of node activities within 
+    a time window of length delta. Returns a matrix of shape (n, len(cols)).
+
+    @param src: array of source nodes of all links, ordered by time
+    @param dst: array of target nodes of all links, ordered by time
+    @param times: array of time stamps of all links, in ascending order
+    @param n: the number of nodes
+    @param delta: the maximum waiting time to be used for the definition of time-respecting paths
+    @param cols: array of target nodes to which distances are computed
+    """
+
+    time_values, starts = np.unique(times, return_index=True)
+    time_ptr = np.append(starts, len(times))
+
+    # Position of each node in cols, or -1
+    col = np.zeros(n, dtype=np.int64)
+    col.fill(-1)
+    col[cols] = np.arange(len(cols))
+
+    minD = np.zeros(shape=(n,len(cols)))
+    minD.fill(np.inf)
+    minD[cols, np.arange(len(cols))] = 0
+
+    # For each node w, the vectors H[w,ts] within the current time window, in decreasing order of ts
+    windows = [deque() for v in range(n)]
+
+    # Nodes w for which a vector H[w,ts] has been recorded, in decreasing order of ts
+    expiry = deque()
+
+    for i in range(len(time_values)-1, -1, -1):
+        ts = time_values[i]
+        i_src = src[time_ptr[i]:time_ptr[i+1]]
+        i_dst = dst[time_ptr[i]:time_ptr[i+1]]
+
+        # Discard vectors which are outside of the time window for all remaining links
+        while len(expiry) > 0 and windows[expiry[0]][0][0] >= ts+1+delta:
+            windows[expiry.popleft()].popleft()
+
+        # Minimum path lengths from all target nodes within the time window
+        targets, inv = np.unique(i_dst, return_inverse=True)
+        M = np.zeros(shape=(len(targets),len(cols)))
+        M.fill(np.inf)
+        for j in range(len(targets)):
+            for (ts_w, H) in windows[targets[j]]:
+                if ts_w >= ts+1:
+                    np.minimum(M[j], H, out=M[j])
+
+        # Path lengths for all links (v,w;ts), where w is reached in a single step
+        L = M[inv.reshape(-1)] + 1
+        direct = np.flatnonzero(col[i_dst] >= 0)
+        L[direct, col[i_dst[direct]]] = 1
+
+        # Minimum over all links with a common source
+        order = np.argsort(i_src, kind='mergesort')
+        sources, starts = np.unique(i_src[order], return_index=True)
+        H = np.minimum.reduceat(L[order], starts, axis=0)
+
+        minD[sources] = np.minimum(minD[sources], H)
+        for j in range(len(sources)):
+            windows[sources[j]].append((ts, H[j]))
+            expiry.append(sources[j])
+
+    return minD
+
+
+def GetTemporalDistanceMatrix(t, start_t=-1, delta=1, collect_paths=True, workers=1, out=None):
     """A new and faster method to compute the (topologically) shortest time-respecting paths between 
     all pairs of nodes starting at time start_t in an empirical temporal network t.
     This function returns a tuple consisting of 
@@ -148,7 +286,14 @@ def GetTemporalDistanceMatrix(t, start_t=-1, delta=1, collect_paths=True):
         in the class TemporalNetwork
     @param collect_paths: whether or not to collect all shortest time-respecting paths (default = True). If this is 
         set to False, the method will only compute the lengths of shortest time-respecting paths, but not return the actual 
-        paths.
+        paths. Since the number of shortest paths can grow exponentially with their length, 
+        GetTemporalPathCounts should be used if only the number of paths is needed.
+    @param workers: the number of worker processes among which the searches from different 
+        source nodes are distributed. This is only supported if collect_paths is False.
+    @param out: an optional destination to which D is written in blocks of rows, rather than allocating 
+        a dense matrix. This can either be an array of shape (n,n), e.g. a np.memmap, or a function f(rows, D_rows) 
+        which is called for each block of rows. Arrays of an integer type such as np.uint16 store unreachable 
+        pairs as the maximum value of this type. If out is a function, None is returned instead of D.
         """
 
     if start_t == -1:
@@ -157,67 +302,531 @@ def GetTemporalDistanceMatrix(t, start_t=-1, delta=1, collect_paths=True):
     # Initialize dictionary taking shortest paths 
     Paths = defaultdict( lambda: defaultdict( lambda: [] ) )
 
-    # Get a mapping between node names and matrix indices
-    name_map = Utilities.firstOrderNameMap( t )
+    if collect_paths == False:
+        D, S, bw = _allSourcesSearch(t, start_t, delta, workers, out=out)
+        return D, Paths
+
+    index = _temporalIndex(t, delta)
+    state_node, state_time = index[3], index[4]
 
     # Initialize topological distance matrix
-    # TODO: This may yield a memory problem for large graphs 
-    D = np.zeros(shape=(len(t.nodes),len(t.nodes)))
-    D.fill(np.inf)
+    D, write = _rowWriter(out, len(t.nodes))
+
+    # For each node v, calculate shortest paths to all other nodes ... 
+    for i in range(len(t.nodes)):
+        v = t.nodes[i]
+        dist, sigma, levels = _temporalSearch(index, i, start_t)
+        D_row, targets = _shortestTargets(index, i, dist)
+        write(np.array([i]), D_row.reshape(1,-1))
+
+        # Concatenate the paths leading to each state in the shortest path DAG 
+        # with the node and time of this state
+        paths = { len(state_node): [ [(v,start_t)] ] }
+        for (P, C) in levels:
+            for p, c in zip(P.tolist(), C.tolist()):
+                step = (t.nodes[state_node[c]], state_time[c].item())
+                paths.setdefault(c, []).extend([q + [step] for q in paths[p]])
+        Paths[v][v] = paths[len(state_node)]
+        for c in np.flatnonzero(targets).tolist():
+            w = t.nodes[state_node[c]]
+            Paths[v][w] = Paths[v][w] + paths[c]
 
-    # For each node v, calculate shortest/fastest paths to all other nodes ... 
-    for v in t.nodes:
-        
-        # Mark node v as visited at the start time start_t... 
-        D[name_map[v], name_map[v]] = 0        
-        Paths[v][v] = [ [(v,start_t)] ]
-
-        stack = set([ (v, start_t) ])
-        
-        # While there are nodes, which could possibly continue a time-respecting path
-        while len(stack)>0:
-
-            (x,ts) = stack.pop()
-
-            # Get indices of time range within which a time-respecting path via x 
-            # can possibly be continued
-            min_ix = bisect_left(t.activities[x], ts)
-            max_ix = bisect_left(t.activities[x], ts+delta)-1
-
-            # For all time-stamps at which x is a source node ... 
-            for j in range(min_ix, max_ix+1):
-                time = t.activities[x][j]
-
-                # For all edges starting at node x at this time
-                for e in t.sources[time][x]:
-
-                    # We found a new node on a time-respecting path
-                    new_node = (e[1], time+1)
-                    
-                    # This node can again continue time-respecting paths
-                    # The set will take care that no duplicates are recorded
-                    stack.add( new_node )
-
-                    # Check whether we found a time-respecting path shorter than the current shortest one ... 
-                    if D[name_map[v], name_map[e[1]]] > D[name_map[v], name_map[e[0]]] + 1:
-                        
-                        # In this case we update the distance matrix
-                        D[name_map[v], name_map[e[1]]] = D[name_map[v], name_map[e[0]]] + 1
-
-                        if collect_paths == True:
-                            # Delete any previous shortest paths 
-                            Paths[v][e[1]] = []
-
-                            # Collect all paths to e[0] and concatenate with the current node e[1]
-                            for p in Paths[v][e[0]]:
-                                Paths[v][e[1]] = Paths[v][e[1]] + [p + [(e[1],time+1)]]
-
-                    # We may also have found a path that has the same length as other shortest paths ...
-                    elif collect_paths == True and D[name_map[v], name_map[e[1]]] == D[name_map[v], name_map[e[0]]] + 1:
-
-                        # Collect all paths to e[0] and concatenate with the current node e[1]
-                        for p in Paths[v][e[0]]:
-                            Paths[v][e[1]] = Paths[v][e[1]] + [p + [(e[1],time+1)]]
-        
     # The algorithm terminates as soon as it is impossible to continue any of the time-respecting paths
-    return D, Paths
\ No newline at end of file
+    return D, Paths
+
+
+def GetTemporalPathCounts(t, start_t=-1, delta=1, workers=1):
+    """Computes the lengths as well as the numbers of shortest time-respecting paths between 
+    all pairs of nodes, without collecting the paths themselves. This function returns a tuple 
+    consisting of 
+        1) a matrix D containing the shortest time-respecting path lengths between all 
+            pairs of nodes, as in GetTemporalDistanceMatrix
+        2) a matrix S containing the number of different shortest time-respecting paths 
+            between all pairs of nodes, where S[v,v] = 1.
+    The ordering of rows/columns corresponds to the ordering of nodes in the vertex sequence 
+    of the igraph first order time-aggregated network. A mapping between nodes and indices 
+    can be found in Utilities.firstOrderNameMap().
+
+    @param t: the temporal network to calculate shortest time-respecting paths for
+    @param start_t: the start time for which to consider time-respecting paths (default is t.ordered_times[0]).
+        If start_t is None, time-respecting paths starting at any time are considered. 
+    @param delta: the maximum time difference to be used in the time-respecting path definition (default 1)
+    @param workers: the number of worker processes among which the searches from different 
+        source nodes are distributed
+    """
+
+    if start_t == -1:
+        start_t = t.ordered_times[0]
+
+    D, S, bw = _allSourcesSearch(t, start_t, delta, workers, counts=True)
+    return D, S
+
+
+def _allSourcesSearch(t, start_t, delta=1, workers=1, counts=False, betweenness=False, out=None):
+    """Runs a search for shortest time-respecting paths (see _temporalSearch) from all nodes. 
+    Returns a tuple consisting of the distance matrix D, the matrix S of the numbers of 
+    shortest paths (if counts is True) and the array of the numbers of shortest paths 
+    passing through each node (if betweenness is True). Rows of D are written to out 
+    in blocks (see _rowWriter).
+    If workers > 1, the searches are distributed among a pool of worker processes. These 
+    share the index of the temporal network, and directly write rows of D and S to shared 
+    memory. If out is given, blocks of rows are instead passed back to the main process.
+    Since the index is shared with worker processes by forking the main process, all searches 
+    run in the main process on platforms which do not support the fork start method.
+    """
+
+    if start_t == -1:
+        start_t = t.ordered_times[0]
+
+    if workers > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+        Log.add('Worker processes require the fork start method, running searches in a single process', Severity.WARNING)
+        workers = 1
+
+    index = _temporalIndex(t, delta)
+    n = len(t.nodes)
+    bw = np.zeros(n)
+
+    # Blocks of source nodes, where each block holds consecutive nodes
+    block = _blockRows(n)
+    if workers > 1 and n > 1:
+        blocks = np.array_split(np.arange(n), min(n, max(workers * 4, n // block)))
+    else:
+        blocks = [np.arange(start, min(start+block, n)) for start in range(0, n, block)]
+
+    if workers > 1 and n > 1:
+        D_shared = multiprocessing.RawArray('d', n*n) if out is None else None
+        S_shared = multiprocessing.RawArray('d', n*n) if counts else None
+        if out is not None:
+            D, write = _rowWriter(out, n)
+        context = multiprocessing.get_context('fork')
+        with context.Pool(workers, initializer=_initSearchWorker, initargs=(index, start_t, D_shared, S_shared, n, betweenness)) as pool:
+            for rows, D_rows, bw_rows in pool.imap(_searchWorker, blocks):
+                if D_rows is not None:
+                    write(rows, D_rows)
+                bw += bw_rows
+        if out is None:
+            D = np.frombuffer(D_shared).reshape(n,n)
+        S = np.frombuffer(S_shared).reshape(n,n) if counts else None
+    else:
+        D, write = _rowWriter(out, n)
+        S = np.zeros(shape=(n,n)) if counts else None
+        for rows in blocks:
+            D_rows = np.zeros(shape=(len(rows),n))
+            S_rows = S[rows[0]:rows[-1]+1] if counts else None
+            bw += _searchRows(index, rows, start_t, D_rows, S_rows, betweenness)
+            write(rows, D_rows)
+    return D, S, (bw if betweenness else None)
+
+
+# Data shared with the processes of a worker pool (see _allSourcesSearch)
+_shared = None
+
+
+def _initSearchWorker(index, start_t, D_shared, S_shared, n, betweenness):
+    """Initializes a worker process with the shared index and result matrices"""
+    global _shared
+    D = np.frombuffer(D_shared).reshape(n,n) if D_shared is not None else None
+    S = np.frombuffer(S_shared).reshape(n,n) if S_shared is not None else None
+    _shared = (index, start_t, D, S, n, betweenness)
+
+
+def _searchWorker(rows):
+    """Runs searches from a block of consecutive source nodes in a worker process. Returns 
+    the block of rows of the distance matrix, unless it has been written to shared memory."""
+    index, start_t, D, S, n, betweenness = _shared
+    if D is not None:
+        D_rows = D[rows[0]:rows[-1]+1]
+    else:
+        D_rows = np.zeros(shape=(len(rows),n))
+    S_rows = S[rows[0]:rows[-1]+1] if S is not None else None
+    bw = _searchRows(index, rows, start_t, D_rows, S_rows, betweenness)
+    return rows, (D_rows if D is None else None), bw
+
+
+def _searchRows(index, sources, start_t, D, S, betweenness):
+    """Runs searches from the given source nodes, writes the corresponding rows of the 
+    distance matrix D and (if not None) the matrix S of the numbers of shortest paths, 
+    where the k-th row corresponds to the k-th source node. Returns the numbers of 
+    shortest paths between pairs of other nodes which pass through each node, if 
+    betweenness is True."""
+
+    state_node = index[3]
+    n = D.shape[1]
+    bw = np.zeros(n)
+    for k in range(len(sources)):
+        v = sources[k]
+        dist, sigma, levels = _temporalSearch(index, v, start_t)
+        D[k], targets = _shortestTargets(index, v, dist)
+
+        if S is not None:
+            S[k] = np.bincount(state_node, weights=(sigma * targets)[:-1], minlength=n)
+            S[k,v] = 1
+
+        if betweenness:
+            # dependency[x] counts the paths from state x to states which are reached by 
+            # shortest time-respecting paths from v, such that sigma[x]*dependency[x] shortest 
+            # paths pass through x (in the spirit of Brandes' algorithm)
+            dependency = targets.astype(float)
+            for (P, C) in reversed(levels):
+                np.add.at(dependency, P, dependency[C])
+            through = sigma * (dependency - targets)
+            bw += np.bincount(state_node, weights=through[:-1], minlength=n)
+    return bw
+
+
+def _rowWriter(out, n):
+    """Returns a tuple (D, write) consisting of the distance matrix to be returned and 
+    a function write(rows, D_rows) which stores a block of rows of the matrix. If out is 
+    None, D is a dense matrix of shape (n,n). If out is an array (e.g. a np.memmap), rows 
+    are written to this array, where unreachable pairs are stored as the maximum value of 
+    integer types. If out is a function, it is called for each block of rows and D is None.
+    """
+
+    if out is None:
+        out = np.zeros(shape=(n,n))
+    if callable(out):
+        return None, out
+
+    def write(rows, D_rows):
+        if np.issubdtype(out.dtype, np.integer):
+            D_rows = np.where(np.isinf(D_rows), np.iinfo(out.dtype).max, D_rows)
+        out[rows[0]:rows[-1]+1] = D_rows
+    return out, write
+
+
+def _blockRows(n):
+    """Returns the number of rows of an (n,n) distance matrix which are computed 
+    and stored in a single block"""
+    return max(1, 2**22 // max(n, 1))
+
+
+def _temporalIndex(t, delta=1):
+    """Generates the index used for the breadth-first search of shortest time-respecting paths 
+    in _temporalSearch. The states of this search are pairs (x,ts) of a node x and a time ts at 
+    which a time-respecting path arrives in x, i.e. ts-1 is the time stamp of a link (*,x;ts-1). 
+    A time-respecting path can be continued in state (x,ts) by all links (x,*;ts') with 
+    ts <= ts' < ts+delta. The index is a tuple consisting of
+        1) the array positions lo and hi, such that state i can be continued by links 
+            at positions [lo[i], hi[i]) of the index returned by EdgeArrays.outLinks
+        2) an array holding the state reached by each of these links
+        3) arrays holding the node and the time of each state 
+        4) the index over link sources returned by EdgeArrays.outLinks and delta
+
+    @param t: the temporal network to generate the index for
+    @param delta: the maximum time difference to be used in the time-respecting path definition
+    """
+
+    out_ptr, out_times, out_dst = t.getEdgeArrays().outLinks()
+    out_src = np.repeat(np.arange(len(out_ptr)-1), np.diff(out_ptr))
+
+    # Identify the distinct states reached by links
+    arrival = out_times + 1
+    order = np.lexsort((arrival, out_dst))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (out_dst[order][1:] != out_dst[order][:-1]) | (arrival[order][1:] != arrival[order][:-1])
+    link_state = np.empty(len(order), dtype=np.int64)
+    link_state[order] = np.cumsum(first) - 1
+    state_node = out_dst[order][first].astype(np.int64)
+    state_time = arrival[order][first]
+
+    lo = _searchLinks(out_src, out_times, state_node, state_time)
+    hi = _searchLinks(out_src, out_times, state_node, state_time + delta)
+    return lo, hi, link_state, state_node, state_time, (out_ptr, out_times), delta
+
+
+def _searchLinks(out_src, out_times, nodes, times):
+    """For each pair (x,ts) in nodes and times, returns the position of the first link 
+    (x,*;ts') with ts' >= ts in the index of links ordered by source and time"""
+
+    # Sort links and queries together, where queries precede links with the same source and time
+    keys_src = np.concatenate((out_src, nodes))
+    keys_time = np.concatenate((out_times, times))
+    is_link = np.concatenate((np.ones(len(out_src), dtype=np.int64), np.zeros(len(nodes), dtype=np.int64)))
+    order = np.lexsort((is_link, keys_time, keys_src))
+
+    # The position of a query corresponds to the number of links preceding it
+    preceding = np.cumsum(is_link[order]) - is_link[order]
+    pos = np.empty(len(order), dtype=np.int64)
+    pos[order] = preceding
+    return pos[len(out_src):]
+
+
+def _temporalSearch(index, v, start_t):
+    """Breadth-first search for the shortest time-respecting paths starting in node v at time 
+    start_t (see _temporalIndex). If start_t is None, paths can start with any link (v,*;ts). 
+    Returns a tuple consisting of the distances and the numbers sigma of shortest paths for 
+    all states, where the last entry corresponds to the start state and unreached states have 
+    distance -1, as well as a list holding the links (P,C) of the shortest path DAG between 
+    each pair of subsequent levels of the search."""
+
+    lo, hi, link_state, state_node, state_time, (out_ptr, out_times), delta = index
+    root = len(state_node)
+
+    dist = np.zeros(root+1, dtype=np.int64)
+    dist.fill(-1)
+    sigma = np.zeros(root+1)
+    dist[root] = 0
+    sigma[root] = 1
+
+    # Links which continue time-respecting paths in the start state
+    start, end = out_ptr[v], out_ptr[v+1]
+    if start_t is not None:
+        start, end = start + np.searchsorted(out_times[start:end], [start_t, start_t+delta])
+
+    levels = []
+    frontier = np.array([root])
+    L = np.array([start])
+    H = np.array([end])
+    d = 0
+    while len(frontier) > 0:
+        lens = H - L
+        pos = np.repeat(L - np.cumsum(lens) + lens, lens) + np.arange(lens.sum())
+        parents = np.repeat(frontier, lens)
+        children = link_state[pos]
+
+        new = np.unique(children[dist[children] == -1])
+        dist[new] = d + 1
+
+        # Links to states at the next level, where parallel links are only counted once
+        mask = dist[children] == d + 1
+        dag = np.unique(parents[mask] * (root+1) + children[mask])
+        P = dag // (root+1)
+        C = dag % (root+1)
+        np.add.at(sigma, C, sigma[P])
+        levels.append((P, C))
+
+        frontier = new
+        L = lo[new]
+        H = hi[new]
+        d += 1
+    return dist, sigma, levels
+
+
+def _shortestTargets(index, v, dist):
+    """Returns the distances from node v to all nodes computed by _temporalSearch, as well 
+    as a boolean mask of those states which are reached by shortest time-respecting paths"""
+
+    state_node = index[3]
+    n = len(index[5][0]) - 1
+    D = np.zeros(n)
+    D.fill(np.inf)
+    D[v] = 0
+    reached = np.flatnonzero(dist[:-1] >= 0)
+    np.minimum.at(D, state_node[reached], dist[reached])
+
+    targets = np.zeros(len(dist), dtype=bool)
+    targets[reached] = (dist[reached] == D[state_node[reached]]) & (state_node[reached] != v)
+    return D, targets
+
+
+def GetTemporalReachability(t, start_t=None, delta=1, packed=True):
+    """Computes which nodes can be reached from each node via time-respecting paths, 
+    without computing the lengths of these paths. The reachable nodes are computed in 
+    a single sweep over all time-stamped links in reverse time order, where the set of 
+    nodes reachable via paths starting with links (v,*;ts) is stored as a packed bitset 
+    for each pair (v,ts). The result is a matrix R, where row v holds the set of nodes 
+    reachable from v (including v itself). The ordering of rows/columns corresponds to 
+    the ordering of nodes in the vertex sequence of the igraph first order time-aggregated 
+    network. 
+
+    @param t: the temporal network to calculate reachability for
+    @param start_t: the start time for which to consider time-respecting paths, i.e. the first link 
+        of a path must occur at a time ts with start_t <= ts < start_t+delta. If None (default), 
+        time-respecting paths starting at any time are considered.
+    @param delta: the maximum time difference to be used in the time-respecting path definition (default 1)
+    @param packed: if True (default), R is a numpy array of shape (n, ceil(n/64)) of type uint64, in 
+        which node w is represented by bit w%64 of word w//64. Otherwise, R is a boolean matrix of shape (n,n).
+    """
+
+    n = len(t.nodes)
+    words = (n + 63) // 64
+    nodes = np.arange(n)
+
+    # Each node is reachable from itself
+    R = np.zeros(shape=(n,words), dtype='<u8')
+    R[nodes, nodes >> 6] = _bits(nodes)
+
+    def mark(L, targets):
+        L[np.arange(len(targets)), targets >> 6] |= _bits(targets)
+
+    R = _reachabilitySweep(t, start_t, delta, R, mark, np.bitwise_or)
+
+    if packed:
+        return R
+    return np.unpackbits(R.view(np.uint8), axis=1, count=n, bitorder='little').astype(bool)
+
+
+def GetTemporalReachSizes(t, start_t=None, delta=1):
+    """Returns an array holding, for each node v, the number of nodes which can be reached 
+    from v via time-respecting paths (including v itself). The ordering of values corresponds 
+    to the ordering of nodes in the vertex sequence of the igraph first order time-aggregated network.
+
+    @param t: the temporal network to calculate reach set sizes for
+    @param start_t: the start time for which to consider time-respecting paths. If None (default), 
+        time-respecting paths starting at any time are considered (see GetTemporalReachability).
+    @param delta: the maximum time difference to be used in the time-respecting path definition (default 1)
+    """
+
+    return _popcount(GetTemporalReachability(t, start_t, delta))
+
+
+def GetTemporalOutComponents(t, start_t=None, delta=1):
+    """Returns a dictionary which maps each node v to the list of nodes which can be reached 
+    from v via time-respecting paths (including v itself).
+
+    @param t: the temporal network to calculate out-components for
+    @param start_t: the start time for which to consider time-respecting paths. If None (default), 
+        time-respecting paths starting at any time are considered (see GetTemporalReachability).
+    @param delta: the maximum time difference to be used in the time-respecting path definition (default 1)
+    """
+
+    R = GetTemporalReachability(t, start_t, delta, packed=False)
+    components = {}
+    for v in range(len(t.nodes)):
+        components[t.nodes[v]] = [t.nodes[w] for w in np.flatnonzero(R[v])]
+    return components
+
+
+def GetTemporalReachSizesApprox(t, start_t=None, delta=1, precision=10, seed=0):
+    """Estimates, for each node v, the number of nodes which can be reached from v via 
+    time-respecting paths (including v itself), using HyperLogLog cardinality sketches. 
+    Each node is hashed to one of 2^precision registers, and the sketches of reachable 
+    sets are merged in a single sweep over all time-stamped links in reverse time order 
+    (see GetTemporalReachability). This requires O(E * 2^precision) time and 
+    O(n * 2^precision) memory, independent of the sizes of reachable sets. The relative 
+    standard error of estimates is about 1.04/sqrt(2^precision). The ordering of values 
+    corresponds to the ordering of nodes in the vertex sequence of the igraph first 
+    order time-aggregated network.
+
+    @param t: the temporal network to estimate reach set sizes for
+    @param start_t: the start time for which to consider time-respecting paths. If None (default), 
+        time-respecting paths starting at any time are considered (see GetTemporalReachability).
+    @param delta: the maximum time difference to be used in the time-respecting path definition (default 1)
+    @param precision: the number of bits used to select a register, between 4 and 16 (default 10)
+    @param seed: the seed of the hash function used to assign nodes to registers
+    """
+
+    if precision < 4 or precision > 16:
+        raise ValueError("precision must be between 4 and 16")
+
+    n = len(t.nodes)
+    m = 2**precision
+    nodes = np.arange(n)
+
+    # The register of each node is given by the first precision bits of its hash value, 
+    # its rank by the position of the first bit set in the remaining bits
+    h = _hash64(nodes.astype(np.uint64) ^ np.uint64(seed))
+    register = (h >> np.uint64(64 - precision)).astype(np.int64)
+    rest = h << np.uint64(precision)
+    rank = np.zeros(n, dtype=np.uint8)
+    rank.fill(64 - precision + 1)
+    for k in range(64 - precision, 0, -1):
+        bit = (rest >> np.uint64(64 - k)) & np.uint64(1)
+        rank[bit == 1] = k
+
+    R = np.zeros(shape=(n,m), dtype=np.uint8)
+    R[nodes, register] = rank
+
+    def mark(L, targets):
+        rows = np.arange(len(targets))
+        L[rows, register[targets]] = np.maximum(L[rows, register[targets]], rank[targets])
+
+    R = _reachabilitySweep(t, start_t, delta, R, mark, np.maximum)
+
+    # HyperLogLog estimate, using linear counting for small cardinalities
+    if m == 16:
+        alpha = 0.673
+    elif m == 32:
+        alpha = 0.697
+    elif m == 64:
+        alpha = 0.709
+    else:
+        alpha = 0.7213/(1 + 1.079/m)
+    estimate = alpha * m**2 / np.exp2(-R.astype(float)).sum(axis=1)
+    zeros = (R == 0).sum(axis=1)
+    small = (estimate <= 2.5*m) & (zeros > 0)
+    estimate[small] = m * np.log(m / zeros[small].astype(float))
+    return estimate
+
+
+def _reachabilitySweep(t, start_t, delta, R, mark, combine):
+    """Propagates summaries of the sets of nodes reachable via time-respecting paths in a single 
+    sweep over all time-stamped links in reverse time order. The set of nodes reachable via paths 
+    starting with links (v,*;ts) is summarized for each pair (v,ts). For a link (v,w;ts), it follows 
+    from w itself and the sets of pairs (w,ts') within the time window ts+1 <= ts' < ts+1+delta. 
+    Summaries which have left this time window are discarded. Returns the array R, in which the 
+    summaries of paths starting from each node v (at any time, or within [start_t, start_t+delta) 
+    if start_t is not None) are merged into row v.
+
+    @param t: the temporal network
+    @param start_t: the start time for which to consider time-respecting paths, or None
+    @param delta: the maximum time difference to be used in the time-respecting path definition
+    @param R: array of shape (n, width) holding the summaries of nodes' own sets
+    @param mark: a function mark(L, targets) adding the nodes targets to the summaries in the rows of L
+    @param combine: a ufunc merging two summaries, e.g. np.bitwise_or for bitsets
+    """
+
+    ea = t.getEdgeArrays()
+    n, width = R.shape
+
+    # For each node w, the summaries of pairs (w,ts) within the current time window, in decreasing order of ts
+    windows = [deque() for v in range(n)]
+
+    # Nodes w for which a summary has been recorded, in decreasing order of ts
+    expiry = deque()
+
+    for i in range(len(ea.time_values)-1, -1, -1):
+        ts = ea.time_values[i]
+        if start_t is not None and ts < start_t:
+            break
+        src = ea.src[ea.time_ptr[i]:ea.time_ptr[i+1]]
+        dst = ea.dst[ea.time_ptr[i]:ea.time_ptr[i+1]]
+
+        # Discard summaries which are outside of the time window for all remaining links
+        while len(expiry) > 0 and windows[expiry[0]][0][0] >= ts+1+delta:
+            windows[expiry.popleft()].popleft()
+
+        # Nodes reachable from all target nodes within the time window
+        targets, inv = np.unique(dst, return_inverse=True)
+        M = np.zeros(shape=(len(targets),width), dtype=R.dtype)
+        for j in range(len(targets)):
+            for (ts_w, B) in windows[targets[j]]:
+                if ts_w >= ts+1:
+                    combine(M[j], B, out=M[j])
+
+        # Nodes reachable via links (v,w;ts), which include w itself
+        L = M[inv.reshape(-1)]
+        mark(L, dst)
+
+        # Merge summaries of all links with a common source
+        order = np.argsort(src, kind='mergesort')
+        sources, starts = np.unique(src[order], return_index=True)
+        B = combine.reduceat(L[order], starts, axis=0)
+
+        for j in range(len(sources)):
+            windows[sources[j]].append((ts, B[j]))
+            expiry.append(sources[j])
+        if start_t is None or ts < start_t + delta:
+            R[sources] = combine(R[sources], B)
+    return R
+
+
+def _hash64(x):
+    """Returns 64 bit hash values of an array of uint64 values (using the finalizer of splitmix64)"""
+    with np.errstate(over='ignore'):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def _bits(nodes):
+    """Returns the uint64 words in which the bits of the given nodes are set"""
+    return np.left_shift(np.uint64(1), (np.asarray(nodes) & 63).astype(np.uint64))
+
+
+def _popcount(R):
+    """Returns the number of bits set in each row of a packed bitset matrix"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(R).sum(axis=1, dtype=np.int64)
+    return np.unpackbits(R.view(np.uint8), axis=1).sum(axis=1, dtype=np.int64)
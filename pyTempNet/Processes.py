@@ -48,14 +48,16 @@ def RWDiffusion(g, samples = 5, epsilon=0.01, max_iterations=100000):
 
 def exportDiffusionMovieFrames(g, file_prefix='diffusion', visual_style = None, steps=100, initial_index=-1):
     """Exports an animation showing the evolution of a diffusion
-           process on the network"""
+           process on the network. If the vertices of the network do not carry a name 
+           attribute, labels need to be passed in the visual style"""
 
     T = Utilities.RWTransitionMatrix(g)
 
     if visual_style == None:
             visual_style = {}
             visual_style["vertex_color"] = "lightblue"
-            visual_style["vertex_label"] = g.vs["name"]
+            if "name" in g.vs.attribute_names():
+                visual_style["vertex_label"] = g.vs["name"]
             visual_style["edge_curved"] = .5
             visual_style["vertex_size"] = 30
 
@@ -178,20 +180,9 @@ def exportRandomWalkMovieFramesFirstOrder(t, file_prefix='random_walk', visual_s
 
     rw_position = initial_index
 
-    # This index allows to quickly map node names to indices in the first-order network
-    map_name_to_id = {}
-    for i in range(len(g1.vs())):
-        map_name_to_id[g1.vs()['name'][i]] = i
-    
-    # Index to quickly map second-order node indices to first-order node indices
-    map_2_to_1 = {}
-    for j in range(len(g2.vs())):
-        # j is index of node in *second-order* network
-        # we first get the name of the *target* of the underlying edge
-        node = g2.vs()["name"][j].split(t.separator)[1]
-
-        # we map the target of second-order node j to the index of the *first-order* node
-        map_2_to_1[j] = map_name_to_id[node]   
+    # Indices of the first-order source and target of each second-order node, where 
+    # the position of the random walker is mapped to the *target* of the underlying edge
+    source, target = t.secondOrderNodes(g2)
 
     color_wheel=['green', 'red', 'orange','tomato']
     restart_ctr=0
@@ -200,13 +191,13 @@ def exportRandomWalkMovieFramesFirstOrder(t, file_prefix='random_walk', visual_s
     base_size = visual_style["vertex_size"]
     sizes = [visual_style["vertex_size"] for x in g1.vs()]
     visit_counts = [0]*len(g1.vs())
-    visit_counts[map_2_to_1[rw_position]] = 1
+    visit_counts[target[rw_position]] = 1
 
     # Create video frames
     for i in range(0,steps):            
         
         # highlight current position of random walker 
-        visual_style["vertex_color"][map_2_to_1[rw_position]] = color_wheel[restart_ctr%len(color_wheel)]
+        visual_style["vertex_color"][target[rw_position]] = color_wheel[restart_ctr%len(color_wheel)]
 
         # highlight last link
         if last_edge >=0:
@@ -250,10 +241,9 @@ def exportRandomWalkMovieFramesFirstOrder(t, file_prefix='random_walk', visual_s
                 probs = [g2.es()[g2.get_eid(rw_position, s)]["weight"] for s in successors]
                 probs = probs/np.sum(probs)
                 new = np.random.choice(a=successors, p=probs)
-                edge = g2.vs()[new]["name"].split(t.separator)
-                last_edge = g1.get_eid(g1.vs.find(edge[0]), g1.vs.find(edge[1]))
+                last_edge = g1.get_eid(source[new], target[new])
                 rw_position = new
-            visit_counts[map_2_to_1[rw_position]] = visit_counts[map_2_to_1[rw_position]]+1
+            visit_counts[target[rw_position]] = visit_counts[target[rw_position]]+1
 
 
 def exportDiffusionVideo(t, output_file, visual_style = None, steps = 100, initial_index=-1, fps=10, model='SECOND'):
@@ -311,20 +301,8 @@ def exportDiffusionMovieFramesFirstOrder(t, file_prefix='diffusion', visual_styl
     x = np.zeros(len(g2.vs()))
     x[initial_index] = 1
 
-    # This index allows to quickly map node names to indices in the first-order network
-    map_name_to_id = {}
-    for i in range(len(g1.vs())):
-        map_name_to_id[g1.vs()['name'][i]] = i
-    
-    # Index to quickly map second-order node indices to first-order node indices
-    map_2_to_1 = {}
-    for j in range(len(g2.vs())):
-        # j is index of node in *second-order* network
-        # we first get the name of the *target* of the underlying edge
-        node = g2.vs()["name"][j].split(t.separator)[1]
-
-        # we map the target of second-order node j to the index of the *first-order* node
-        map_2_to_1[j] = map_name_to_id[node]
+    # Sparse matrix which maps second-order nodes to the *target* of the underlying edge
+    P = t.projectionMatrix(g2, 'TARGET')
 
     # compute stationary state of random walk process
     pi = Utilities.StationaryDistribution(T)
@@ -344,13 +322,7 @@ def exportDiffusionMovieFramesFirstOrder(t, file_prefix='diffusion', visual_styl
         # based on visitation probabilities in *second-order* aggregate network, 
         # we need to compute visitation probabilities of nodes in the *first-order* 
         # aggregate network
-        x_firstorder = np.zeros(len(g1.vs()))
-        
-        # j is the index of nodes in the *second-order* network, which we need to map 
-        # to nodes in the *first-order* network
-        for j in range(len(x)):
-            if x[j] > 0:
-                x_firstorder[map_2_to_1[j]] = x_firstorder[map_2_to_1[j]] + x[j]            
+        x_firstorder = P.dot(np.where(x > 0, x, 0))
         
         # Perform some reasonable color scaling
         visual_style["vertex_color"] = [color_p(np.power((p-min(x))/(max(x)-min(x)),exp)) for p in x_firstorder]
@@ -8,13 +8,19 @@ Created on Thu Feb 19 11:49:39 2015
 
 import igraph
 import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.linalg as sla
 from collections import defaultdict
 
+from bisect import bisect_left
 from bisect import bisect_right
+from bisect import insort
 
 from pyTempNet.Utilities import RWTransitionMatrix
 from pyTempNet.Utilities import StationaryDistribution
 from pyTempNet.Log import *
+from pyTempNet import EdgeArrays
+from pyTempNet import TwoPaths
 
 class EmptySCCError(Exception):
     """An exception that will be thrown whenever we require a non-empty strongly 
@@ -24,16 +30,36 @@ class EmptySCCError(Exception):
 class TemporalNetwork:
     """A class representing a temporal network consisting of a sequence of time-stamped edges"""
     
-    def __init__(self,  sep=',', tedges = None, twopaths = None):
+    def __init__(self,  sep=',', tedges = None, twopaths = None, storage='DICT'):
         """Constructor generating a temporal network instance
         
-        @param sep: a separator character to be used for the naming of higher-order nodes v-w
+        @param sep: a separator character to be used for the naming of higher-order nodes v-w 
+            (see secondOrderNames)
         @param tedges: an optional list of (possibly unordered time-stamped) links from which to 
-            construct a temporal network instance
-        @param twopaths: an optional list of two-paths from which to 
-            construct a temporal network instance
+            construct a temporal network instance. For storage ARRAY, this can also be an 
+            EdgeArrays instance.
+        @param twopaths: an optional list of two-paths (s,v,d,weight) from which to 
+            construct a temporal network instance, where each entry counts as one occurrence 
+            of a two-path. This can also be a TwoPathStore, whose occurrence counts are retained 
+            (see filterTwoPaths).
+        @param storage: either C{"DICT"} or C{"ARRAY"}, where C{"DICT"} is the default value. 
+            For C{"DICT"}, time-stamped links are stored as tuples in dictionary-based index structures. 
+            For C{"ARRAY"}, nodes are mapped to integer ids and time-stamped links are stored in 
+            parallel, time-ordered numpy arrays. In this case, tedges, time, sources, targets, 
+            activities and ordered_times are read-only views on these arrays.
         """
-        
+        assert storage == 'DICT' or storage == 'ARRAY'
+
+        self.storage = storage
+
+        # Cached columnar representation of time-stamped links
+        self.edgearrays = None
+
+        # Dictionary mapping node names to their index in the list of nodes, used for fast 
+        # membership tests when edges are added, as well as the list of nodes it has been generated from
+        self._node_ids = {}
+        self._node_ids_list = None
+
         self.tedges = []
         nodes_seen = defaultdict( lambda:False )
         self.nodes = []
@@ -62,7 +88,25 @@ class TemporalNetwork:
 
         self.tedges = []
 
-        if tedges is not None:
+        if storage == 'ARRAY':
+            Log.add('Building edge arrays ...')
+            if isinstance(tedges, EdgeArrays.EdgeArrays):
+                self.edgearrays = tedges
+            elif tedges is not None:
+                self.edgearrays = EdgeArrays.edgeArraysFromTEdges(tedges)
+            else:
+                self.edgearrays = EdgeArrays.EdgeArrays()
+            ea = self.edgearrays
+            self.nodes = ea.nodes
+            self.tedges = EdgeArrays.TEdgesView(ea)
+            self.time = EdgeArrays.TimeView(ea)
+            self.targets = EdgeArrays.NodeIndexView(ea, 1)
+            self.sources = EdgeArrays.NodeIndexView(ea, 0)
+            self.activities = EdgeArrays.ActivitiesView(ea)
+            self.activities_sets = None
+            self.ordered_times = EdgeArrays.OrderedTimesView(ea)
+            Log.add('finished.')
+        elif tedges is not None:
             Log.add('Building index data structures ...')
 
             for e in tedges:
@@ -85,11 +129,13 @@ class TemporalNetwork:
                 self.activities[v] = sorted(self.activities_sets[v])
             Log.add('finished.')
 
-        # Index structures for two-path structures
+        # Index structures for two-path structures. The indices by node, time and source 
+        # are generated on first access (see properties twopathsByNode, twopathsByTime and twopathsBySource)
+        self._tpdict = None
         self.twopaths = []
-        self.twopathsByNode = defaultdict( lambda: dict() )
-        self.twopathsByTime = defaultdict( lambda: dict() )
-        self.twopathsBySource = defaultdict( lambda: dict() )
+        self._twopathsByNode = None
+        self._twopathsByTime = None
+        self._twopathsBySource = None
         self.tpcount = -1
 
         """The separator character to be used to generate higher-order nodes"""
@@ -99,32 +145,58 @@ class TemporalNetwork:
         for extraction of time-respecting paths of length two"""
         self.delta = 1                                    
 
+        """Whether or not cached two-paths and aggregate networks are updated incrementally 
+        when edges are added (see setIncremental)"""
+        self.incremental = False
+
         # Generate index structures if temporal network is constructed from two-paths
-        if twopaths is not None:
+        if isinstance(twopaths, TwoPaths.TwoPathStore):
+            node_id = self.getEdgeArrays().nodeId
+            ids = np.zeros(len(twopaths.nodes), dtype=np.int32)
+            for i in np.unique(np.concatenate((twopaths.s, twopaths.v, twopaths.d))).tolist():
+                ids[i] = node_id(twopaths.nodes[i])
+            self.twopaths = twopaths.relabel(self.nodes, ids)
+            self.tpcount = self.twopaths.totalCount()
+        elif twopaths is not None:
+            node_id = self.getEdgeArrays().nodeId
+            m = len(twopaths)
+            ids = np.zeros(shape=(m, 3), dtype=np.int32)
+            weights = np.zeros(m)
             t = 0
             for tp in twopaths:
-                self.twopaths.append(tp)
                 s = tp[0]
                 v = tp[1]
                 d = tp[2]
 
-                if s not in self.nodes:
-                    self.nodes.append(s)
-                if v not in self.nodes:
-                    self.nodes.append(v)
-                if d not in self.nodes:
-                    self.nodes.append(d)
-  
-                self.twopathsByNode[v].setdefault(t, []).append(tp)
-                self.twopathsBySource[s].setdefault(t, []).append(tp)
+                ids[t] = (node_id(s), node_id(v), node_id(d))
+                weights[t] = tp[3]
                 t +=1
-            self.tpcount = len(twopaths)        
+
+            # The index of a two-path in the given list is used as its time stamp
+            occurrences = (ids[:,0], ids[:,1], ids[:,2], weights, np.arange(m))
+            self.twopaths = TwoPaths.aggregateTwoPaths(self.nodes, ids[:,0], ids[:,1], ids[:,2], weights, occurrences)
+            self.tpcount = self.twopaths.totalCount()
 
         # Cached instances of first- and second-order aggregate networks
         self.g1 = 0
         self.g2 = 0
         self.g2n = 0
 
+        # Whether or not the cached first-order network has been generated from all links
+        self._g1_all_links = False
+
+        # Cached arrays of first-order source and target nodes of second-order nodes, as well 
+        # as a dictionary mapping pairs of first-order nodes to second-order nodes
+        self._g2nodes = None
+        self._g2index = None
+
+        # Cached sparse projection matrices from second- to first-order nodes
+        self._projections = {}
+
+        # Cached spectral data (strongly connected components, transition matrices, stationary 
+        # distributions and eigenvalues), indexed by model FIRST, SECOND or NULL
+        self._spectral = {}
+
       
     def filterEdges(self, edge_filter):
         """Allows to filter time-stamped edges according to a given filter expression. 
@@ -144,28 +216,42 @@ class TemporalNetwork:
 
         Log.add('finished. Filtered out ' + str(self.ecount() - len(new_t_edges)) + ' time-stamped edges.', Severity.INFO)
 
-        return TemporalNetwork(sep=self.separator, tedges=new_t_edges)
+        return TemporalNetwork(sep=self.separator, tedges=new_t_edges, storage=self.storage)
 
 
-    def filterTwoPaths(self, twopath_filter):
+    def filterTwoPaths(self, twopath_filter, aggregated=False):
         """Allows to filter two paths according to a given filter function. 
 
-        @param twopath_filter: an arbitrary filter function of the form filter_func(s, v, d) that 
+        @param twopath_filter: an arbitrary filter function of the form filter_func(s, v, d, w) that 
             returns True for two paths that shall pass the filter, and False for all two paths that shall be filtered out.
             Note that for the purpose of filtering, the first- or the second-order aggregate networks of the TemporalNetwork 
             instance can be used. 
+        @param aggregated: if False (default), the filter is evaluated for each occurrence of a two-path, where w is 
+            the weight of the individual occurrence. If True, the filter is evaluated only once for each unique two-path 
+            (s,v,d), where w is its weight accumulated over all occurrences, and all occurrences of a two-path either 
+            pass or are filtered out together. In both cases, the two-path count of the resulting network is the 
+            number of occurrences passing the filter.
         """
 
-        Log.add('Starting filtering ...', Severity.INFO)
-        new_twopaths = []
+        if self.tpcount == -1:
+            self.extractTwoPaths()
 
-        for (s,v,d,w) in self.twopaths:
-            if twopath_filter(s,v,d,w):
-                new_twopaths.append((s,v,d,w))
+        Log.add('Starting filtering ...', Severity.INFO)
+        tp = self.twopaths
+        if aggregated:
+            keep = np.array([twopath_filter(s,v,d,w) for (s,v,d,w) in tp], dtype=bool)
+            new_twopaths = tp.select(keep)
+        else:
+            nodes = self.nodes
+            s, v, d, w, t = tp.getOccurrences()
+            keep = np.array([twopath_filter(nodes[x], nodes[y], nodes[z], c) for x, y, z, c in 
+                zip(s.tolist(), v.tolist(), d.tolist(), w.tolist())], dtype=bool)
+            occurrences = (s[keep], v[keep], d[keep], w[keep], t[keep])
+            new_twopaths = TwoPaths.aggregateTwoPaths(tp.nodes, occurrences[0], occurrences[1], occurrences[2], occurrences[3], occurrences)
 
-        Log.add('finished. Filtered out ' + str(self.tpcount - len(new_twopaths)) + ' two paths.', Severity.INFO)
+        Log.add('finished. Filtered out ' + str(tp.totalCount() - new_twopaths.totalCount()) + ' two paths.', Severity.INFO)
 
-        return TemporalNetwork(sep=self.separator, twopaths=new_twopaths)
+        return TemporalNetwork(sep=self.separator, twopaths=new_twopaths, storage=self.storage)
 
 
     def addEdge(self, source, target, ts):
@@ -176,26 +262,273 @@ class TemporalNetwork:
         @param target: name of the target node of a directed, time-stamped link
         @param ts: (integer) time-stamp of the time-stamped link
         """
+        if self.storage == 'ARRAY':
+            # Edges are buffered and merged into the sorted arrays on the next read
+            self.edgearrays.append(source, target, ts)
+            self.InvalidateTwoPaths()
+            return
+
         e = (source, target, ts)
+
+        if self.incremental and self.tpcount >= 0:
+            self._addEdgeIncremental(e)
+            return
+
+        self._indexEdge(e)
+
+        if ts not in self.activities_sets[source]:
+            self.activities_sets[source].add(ts)
+            insort(self.activities[source], ts)
+
+        self.edgearrays = None
+        
+        self.InvalidateTwoPaths()
+
+
+    def addEdges(self, tedges):
+        """Adds a list of directed time-stamped edges (source,target,time) to the temporal network. 
+        Compared to repeated calls of addEdge, the ordering of time stamps is only updated once, 
+        and cached two-paths and aggregate networks are invalidated only once.
+
+        @param tedges: a list of directed time-stamped edges (source,target,time)
+        """
+        if self.storage == 'ARRAY':
+            # Edges are buffered and merged into the sorted arrays on the next read
+            for e in tedges:
+                self.edgearrays.append(e[0], e[1], e[2])
+            self.InvalidateTwoPaths()
+            return
+
+        Log.add('Adding ' + str(len(tedges)) + ' time-stamped edges ...', Severity.DEBUG)
+
+        # Nodes whose activities need to be reordered
+        active = set()
+
+        for e in tedges:
+            self._indexEdge(e)
+            if e[2] not in self.activities_sets[e[0]]:
+                self.activities_sets[e[0]].add(e[2])
+                active.add(e[0])
+
+        for v in active:
+            self.activities[v] = sorted(self.activities_sets[v])
+
+        self.edgearrays = None
+
+        self.InvalidateTwoPaths()
+        
+        Log.add('finished.', Severity.DEBUG)
+
+
+    def _indexEdge(self, e):
+        """Adds a time-stamped edge e=(source,target,time) to the list of edges, the list of nodes, 
+        the ordered list of time stamps, and the index structures by time, source and target."""
+        source = e[0]
+        target = e[1]
+        ts = e[2]
+
         self.tedges.append(e)
-        if source not in self.nodes:
+
+        # Use a dictionary to check whether nodes are new
+        node_ids = self._nodeIds()
+        if source not in node_ids:
+            node_ids[source] = len(self.nodes)
             self.nodes.append(source)
-        if target not in self.nodes:
+        if target not in node_ids:
+            node_ids[target] = len(self.nodes)
             self.nodes.append(target)
 
+        # Insert new time stamps at the right position of the ordered list of time stamps.
+        # For edges arriving in time order, this amounts to an append.
+        if ts not in self.time:
+            insort(self.ordered_times, ts)
+
         # Add edge to index structures
         self.time[ts].append(e)
         self.targets[ts].setdefault(target, []).append(e)
         self.sources[ts].setdefault(source, []).append(e)
 
-        if ts not in self.activities[source]:
-            self.activities[source].append(ts)
-            self.activities[source].sort()
 
-        # Reorder time stamps
-        self.ordered_times = sorted(self.time.keys())
-        
-        self.InvalidateTwoPaths()
+    def _nodeIds(self):
+        """Returns a dictionary mapping node names to their index in the list of nodes"""
+        if self._node_ids_list is not self.nodes or len(self._node_ids) != len(self.nodes):
+            self._node_ids = dict((v, i) for i, v in enumerate(self.nodes))
+            self._node_ids_list = self.nodes
+        return self._node_ids
+
+
+    def setIncremental(self, incremental=True):
+        """Enables or disables the incremental maintenance of two-paths. Once two-paths have been 
+        extracted, adding a time-stamped link (u,v;t) in incremental mode does not invalidate cached 
+        two-paths. Instead, only those two-paths are recomputed whose weights 1/(indeg*outdeg) depend 
+        on the new link, i.e. two-paths through v whose first link occurs at time t and two-paths through u 
+        whose second link occurs at time t. The weights of links in cached first- and second-order aggregate 
+        networks are patched in place, while the second-order null model is invalidated. 
+        Incremental mode requires storage DICT.
+
+        @param incremental: whether or not to update two-paths incrementally
+        """
+        if incremental and self.storage != 'DICT':
+            Log.add('Incremental two-path updates require storage DICT', Severity.ERROR)
+            raise ValueError('Incremental two-path updates require storage DICT')
+        self.incremental = incremental
+
+
+    def _addEdgeIncremental(self, e):
+        """Adds a time-stamped edge e=(source,target,time) and incrementally updates cached 
+        two-paths and aggregate networks (see setIncremental)"""
+        source = e[0]
+        target = e[1]
+        ts = e[2]
+
+        if self._tpdict is None:
+            tp = self.twopaths
+            self._tpdict = dict((x[:3], [x[3], c]) for x, c in zip(tp, tp.count.tolist()))
+
+        # Remove contributions of all two-paths whose weights change ...
+        changes = defaultdict( lambda: [0., 0] )
+        for (s,v,d,w) in self._localTwoPaths(target, source, ts):
+            c = changes[(s,v,d)]
+            c[0] -= w
+            c[1] -= 1
+
+        self._indexEdge(e)
+        if ts not in self.activities_sets[source]:
+            self.activities_sets[source].add(ts)
+            insort(self.activities[source], ts)
+
+        # ... and add them again, together with the two-paths opened or closed by the new edge
+        for (s,v,d,w) in self._localTwoPaths(target, source, ts):
+            c = changes[(s,v,d)]
+            c[0] += w
+            c[1] += 1
+
+        # Keep the ordering of vertices in the first-order network consistent with the list of nodes
+        if self.g1 != 0 and self.g1.vcount() < len(self.nodes):
+            self.g1.add_vertices(self.nodes[self.g1.vcount():])
+
+        node_ids = self._nodeIds()
+        for key, (dw, dc) in changes.items():
+            if dw == 0 and dc == 0:
+                continue
+            entry = self._tpdict.get(key)
+            if entry is None:
+                entry = self._tpdict[key] = [0., 0]
+            entry[0] += dw
+            entry[1] += dc
+            self.tpcount += dc
+
+            s = node_ids[key[0]]
+            v = node_ids[key[1]]
+            d = node_ids[key[2]]
+            if self.g1 != 0 and not self._g1_all_links:
+                self._patchLink(self.g1, s, v, dw)
+                self._patchLink(self.g1, v, d, dw)
+            if self.g2 != 0:
+                self._patchLink(self.g2, self._secondOrderVertex(s, v), self._secondOrderVertex(v, d), dw)
+
+        if self.g1 != 0 and self._g1_all_links:
+            self._patchLink(self.g1, node_ids[source], node_ids[target], 1)
+
+        # Two-paths are regenerated from the updated weights on next access
+        self._tpdirty = True
+        self._twopathsByNode = None
+        self._twopathsByTime = None
+        self._twopathsBySource = None
+        self.edgearrays = None
+        self.g2n = 0
+        self._spectral = {}
+
+
+    def _localTwoPaths(self, v, u, ts):
+        """Returns a list of all two-paths (s,v,d,weight) through v whose first link occurs at time ts, 
+        as well as all two-paths (s,u,d,weight) through u whose second link occurs at time ts."""
+        twopaths = []
+
+        # Links (*,v;ts) continued by links (v,*;t') with ts < t' <= ts+delta
+        in_edges = self.targets.get(ts, {}).get(v, [])
+        if len(in_edges) > 0:
+            acts = self.activities.get(v, [])
+            for t in acts[bisect_right(acts, ts):bisect_right(acts, ts + self.delta)]:
+                out_edges = self.sources[t][v]
+                w = float(1)/(len(in_edges)*len(out_edges))
+                for e_in in in_edges:
+                    for e_out in out_edges:
+                        if e_in[0] != v and e_out[1] != v:
+                            twopaths.append((e_in[0], v, e_out[1], w))
+
+        # Links (u,*;ts) continuing links (*,u;t) with ts-delta <= t < ts
+        out_edges = self.sources.get(ts, {}).get(u, [])
+        if len(out_edges) > 0:
+            times = self.ordered_times
+            for t in times[bisect_left(times, ts - self.delta):bisect_left(times, ts)]:
+                in_edges = self.targets[t].get(u, [])
+                if len(in_edges) == 0:
+                    continue
+                w = float(1)/(len(in_edges)*len(out_edges))
+                for e_in in in_edges:
+                    for e_out in out_edges:
+                        if e_in[0] != u and e_out[1] != u:
+                            twopaths.append((e_in[0], u, e_out[1], w))
+
+        return twopaths
+
+
+    def _patchLink(self, g, i, j, dw):
+        """Adds dw to the weight of the link between vertices i and j in the igraph 
+        instance g, adding the link if necessary"""
+        eid = g.get_eid(i, j, error=False)
+        if eid < 0:
+            g.add_edge(i, j, weight=dw)
+        else:
+            g.es[eid]["weight"] += dw
+
+
+    def _secondOrderVertex(self, v, w):
+        """Returns the index of the vertex corresponding to the link (v,w) between first-order 
+        nodes with indices v and w in the cached second-order network, adding the vertex if necessary"""
+        if self._g2index is None:
+            source, target = self.secondOrderNodes()
+            self._g2index = dict(zip(zip(source.tolist(), target.tolist()), range(len(source))))
+        i = self._g2index.get((v, w), -1)
+        if i < 0:
+            i = self._g2index[(v, w)] = self.g2.vcount()
+            self.g2.add_vertex(name=str(self.nodes[v])+self.separator+str(self.nodes[w]), source=v, target=w)
+            self._g2nodes = None
+        return i
+
+
+    @property
+    def twopaths(self):
+        """A TwoPathStore containing all unique two-paths (s,v,d), along with their accumulated 
+        weights and numbers of occurrences (see extractTwoPaths). In incremental mode, the store is 
+        regenerated from the incrementally updated weights on first access after edges have been added."""
+        if self._tpdirty:
+            self._twopaths = self._incrementalStore()
+            self._tpdirty = False
+        return self._twopaths
+
+
+    @twopaths.setter
+    def twopaths(self, value):
+        self._twopaths = value
+        self._tpdirty = False
+
+
+    def _incrementalStore(self):
+        """Generates a TwoPathStore from the incrementally updated two-path weights and counts"""
+        node_ids = self._nodeIds()
+        keys = list(self._tpdict.keys())
+        values = list(self._tpdict.values())
+        s = np.array([node_ids[k[0]] for k in keys], dtype=np.int32)
+        v = np.array([node_ids[k[1]] for k in keys], dtype=np.int32)
+        d = np.array([node_ids[k[2]] for k in keys], dtype=np.int32)
+        w = np.array([x[0] for x in values], dtype=np.float64)
+        c = np.array([x[1] for x in values], dtype=np.int64)
+        order = np.lexsort((d, s, v))
+        delta = self.delta
+        return TwoPaths.TwoPathStore(self.nodes, s[order], v[order], d[order], w[order], c[order], 
+            lambda: TwoPaths.extractTwoPathArrays(self.getEdgeArrays(), delta))
 
 
     def InvalidateTwoPaths(self):
@@ -203,15 +536,107 @@ class TemporalNetwork:
         
         # Invalidate indexed data 
         self.tpcount = -1
+        self._tpdict = None
         self.twopaths = []
-        self.twopathsByNode = defaultdict( lambda: dict() )
-        self.twopathsByTime = defaultdict( lambda: dict() )
-        self.twopathsBySource = defaultdict( lambda: dict() )
+        self._twopathsByNode = None
+        self._twopathsByTime = None
+        self._twopathsBySource = None
         self.g1 = 0
         self.g2 = 0
         self.g2n = 0
+        self._g2nodes = None
+        self._g2index = None
+        self._projections = {}
+        self._spectral = {}
+
+
+    @property
+    def twopathsByNode(self):
+        """A dictionary storing all two-paths (s,v,d,weight), indexed by middle node v and 
+        the time t of the first link. This index is generated on first access, and cached 
+        until two-paths are invalidated."""
+        if self._twopathsByNode is None:
+            self._twopathsByNode = self._indexTwoPaths(1, 4)
+        return self._twopathsByNode
+
+
+    @property
+    def twopathsByTime(self):
+        """A dictionary storing all two-paths (s,v,d,weight), indexed by the time t of the 
+        first link and middle node v. This index is generated on first access, and cached 
+        until two-paths are invalidated."""
+        if self._twopathsByTime is None:
+            self._twopathsByTime = self._indexTwoPaths(4, 1)
+        return self._twopathsByTime
+
+
+    @property
+    def twopathsBySource(self):
+        """A dictionary storing all two-paths (s,v,d,weight), indexed by source node s and 
+        the time t of the first link. This index is generated on first access, and cached 
+        until two-paths are invalidated."""
+        if self._twopathsBySource is None:
+            self._twopathsBySource = self._indexTwoPaths(0, 4)
+        return self._twopathsBySource
+
+
+    def _indexTwoPaths(self, outer, inner):
+        """Generates a nested dictionary of lists of all occurrences of two-paths (s,v,d,weight), 
+        indexed by two of the keys source (0), middle node (1) or time (4)."""
+
+        if self.tpcount == -1:
+            self.extractTwoPaths()
+
+        index = defaultdict( lambda: dict() )
+        nodes = self.nodes
+        s, v, d, w, t = self.twopaths.getOccurrences()
+        for row in zip(s.tolist(), v.tolist(), d.tolist(), w.tolist(), t.tolist()):
+            two_path = (nodes[row[0]], nodes[row[1]], nodes[row[2]], row[3])
+            k1 = two_path[outer] if outer < 3 else row[outer]
+            k2 = two_path[inner] if inner < 3 else row[inner]
+            index[k1].setdefault(k2, []).append(two_path)
+        return index
         
 
+    def getEdgeArrays(self):
+        """Returns a columnar representation of all time-stamped links in terms of an 
+        EdgeArrays instance, in which the integer id of a node corresponds to its index 
+        in the list of nodes. For storage DICT, the arrays are generated on first use and 
+        cached until the next call to addEdge."""
+
+        if self.edgearrays is None or self.edgearrays.nodes is not self.nodes:
+            self.edgearrays = EdgeArrays.edgeArraysFromTEdges(self.tedges, nodes=self.nodes)
+        else:
+            self.edgearrays.flush()
+        return self.edgearrays
+
+
+    def getMemoryUsage(self, sample=100000):
+        """Returns a dictionary reporting the memory (in bytes per time-stamped link) consumed by 
+        the index structures of time-stamped links, both for the dictionary-based (key 'DICT') and 
+        the array-based (key 'ARRAY') storage. The value for the storage which is not used by this 
+        instance is estimated based on a sample of time-stamped links. Node names are not counted.
+
+        @param sample: the maximum number of time-stamped links used to estimate the memory 
+            consumption of the storage not used by this instance
+        """
+        m = max(self.ecount(), 1)
+        if self.storage == 'ARRAY':
+            array_bytes = self.edgearrays.nbytes()
+            s = TemporalNetwork(tedges=self.tedges[:sample])
+            dict_bytes = EdgeArrays.dictLayoutBytes(s.tedges, s.time, s.sources, s.targets, s.activities, s.activities_sets)
+            dict_per_edge = dict_bytes / max(s.ecount(), 1)
+            array_per_edge = array_bytes / m
+        else:
+            dict_bytes = EdgeArrays.dictLayoutBytes(self.tedges, self.time, self.sources, self.targets, self.activities, self.activities_sets)
+            ea = EdgeArrays.edgeArraysFromTEdges(self.tedges[:sample])
+            dict_per_edge = dict_bytes / m
+            array_per_edge = ea.nbytes() / max(ea.ecount(), 1)
+
+        Log.add('Bytes per time-stamped link: ' + str(dict_per_edge) + ' (DICT), ' + str(array_per_edge) + ' (ARRAY)', Severity.INFO)
+        return {'DICT': dict_per_edge, 'ARRAY': array_per_edge}
+
+
     def vcount(self):
         """Returns the total number of different vertices active across the whole evolution of the temporal network. 
         This number corresponds to the number of nodes in the (first-order) time-aggregated network."""
@@ -315,7 +740,7 @@ class TemporalNetwork:
         return summary
 
 
-    def extractTwoPaths(self):
+    def extractTwoPaths(self, workers=1):
         """Extracts all time-respecting paths of length two in this temporal network for the currently set 
         maximum time difference delta. The two-paths extracted by this method will be used in the 
         construction of second-order time-aggregated networks, as well as in the analysis of 
@@ -323,72 +748,53 @@ class TemporalNetwork:
         it will be run with the current parameter delta set in the 
         TemporalNetwork instance (default: delta=1) whenever two-paths are needed for the first time.
         Once two-paths have been computed, they will be cached and reused until the maximum time difference 
-        delta is changed.
+        delta is changed. Two-paths are stored as a TwoPathStore in the attribute twopaths, which contains 
+        each unique two-path (s,v,d) only once, along with its accumulated weight and number of occurrences.
+
+        @param workers: the number of worker processes to be used for the extraction. For workers > 1, 
+            time-stamped links are split into blocks of consecutive time stamps (extended by delta), 
+            which are processed in parallel.
         """
 
         Log.add('Extracting two-paths for delta = ' + str(int(self.delta)) + '...')
 
-        self.tpcount = -1
-        self.twopaths = []
-        self.twopathsByNode = defaultdict( lambda: dict() )
-        self.twopathsByTime = defaultdict( lambda: dict() )
-        self.twopathsBySource = defaultdict( lambda: dict() )
-
-        # Avoid reevaluations in loop
-        tpappend = self.twopaths.append
-        srcs = self.sources
-        tgts = self.targets
-        odts = self.ordered_times
-        dt = self.delta
-
-        # For each time stamp in the ordered list of time stamps
-        for i in range(len(odts)):
-            t = odts[i]
-
-            # For each possible middle node v (i.e. all target nodes at time t) ... 
-            for v in tgts[t]:
-                # Get the minimum and maximum indices of time stamps in the ordered list of "activities" of node v
-                # which continue a time-respecting path, i.e. we are interested in 
-                # the time stamps t' of all links (v,*;t') such that t'  \in (t, t+delta]
-
-                # The minimum index is the index of the smallest time stamp that is larger than t
-                min_ix = bisect_right(self.activities[v], t)
-
-                # The maximum index is the index of the largest time stamp that is smaller or equal than t + delta
-                max_ix = bisect_right(self.activities[v], t+dt)-1
-
-                # For all time-stamped links (v,*;t') with t' \in (t, t+delta] ...
-                for j in range(min_ix, max_ix+1):
-                    future_t = self.activities[v][j]
-                    # For all possible IN-edges at time t that link *to* node v
-                    for e_in in tgts[t][v]:
-                        # Combine with all OUT-edges at time future_t that link *from* v
-                        for e_out in srcs[future_t][v]:
-                            s = e_in[0]
-                            d = e_out[1]
-                            if s != v and v != d:
-                                indeg_v = len(tgts[t][v])
-                                outdeg_v = len(srcs[future_t][v])
-
-                                # Create a weighted two-path tuple
-                                # (s, v, d, weight)
-                                two_path = (s,v,d, float(1)/(indeg_v*outdeg_v))
-
-                                # TODO: Add support for time-stamped links which have link weights w by themselves, i.e. (u,v;t;w)
-
-                                tpappend(two_path)
-                                self.twopathsByNode[v].setdefault(t, []).append(two_path)
-                                self.twopathsByTime[t].setdefault(v, []).append(two_path)
-                                self.twopathsBySource[s].setdefault(t, []).append(two_path)
-        
-        self.tpcount = len(self.twopaths)
-
-        # Invalidate cached aggregate networks
-        g1 = 0
-        g2 = 0
-        g2n = 0                
+        # Invalidate cached two-paths, indices and aggregate networks
+        self.InvalidateTwoPaths()
+
+        # Join in-edges and out-edges of all middle nodes in a vectorized fashion
+        ea = self.getEdgeArrays()
+        delta = self.delta
+        if workers > 1 and ea.ecount() > 0:
+            self.twopaths = TwoPaths.extractTwoPathsParallel(ea, delta, workers)
+            self.tpcount = self.twopaths.totalCount()
+        else:
+            s, v, d, w, t = TwoPaths.extractTwoPathArrays(ea, delta)
+
+            # Store unique two-paths only, while per-time information is recomputed on demand
+            self.twopaths = TwoPaths.aggregateTwoPaths(ea.nodes, s, v, d, w, lambda: TwoPaths.extractTwoPathArrays(ea, delta))
+            self.tpcount = len(s)
+
+        Log.add('finished.')
+
+        
+    def extractTwoPathSweep(self, deltas):
+        """Extracts time-respecting paths of length two for a list of maximum time differences deltas 
+        in a single pass over the time-stamped edge sequence. The cost of this method is close to that of 
+        a single extraction for the largest delta. This method returns a dictionary which maps each delta to 
+        a TwoPathStore, containing the unique two-paths (s,v,d), their accumulated weights (i.e. the weights 
+        of links in the second-order aggregate network) and the number of their occurrences (whose sum is 
+        the two-path count for this delta). Neither the parameter delta, nor the cached two-paths or aggregate 
+        networks of this instance are changed.
+
+        @param deltas: a list of maximum time differences for which two-paths shall be extracted
+        """
+
+        Log.add('Extracting two-paths for ' + str(len(deltas)) + ' values of delta ...')
+        stores = TwoPaths.sweepTwoPaths(self.getEdgeArrays(), deltas)
         Log.add('finished.')
 
+        return stores
+
         
     def TwoPathCount(self):
         """Returns the total number of time-respecting paths of length two (two-paths) 
@@ -425,6 +831,8 @@ class TemporalNetwork:
         Log.add('Constructing first-order aggregate network ...')
 
         self.g1 = igraph.Graph(n=len(self.nodes), directed=True)
+        self._g1_all_links = all_links
+        self._spectral.pop('FIRST', None)
 
         # Make sure that the ordering of vertices matches that in the nodes list
         self.g1.vs["name"] = self.nodes
@@ -437,13 +845,15 @@ class TemporalNetwork:
                 edge_list[(e[0], e[1])] = edge_list.get((e[0], e[1]), 0) + 1
 
         # ... or only consider edges contributing to two paths and their (accumulated) weights
-        else:                    
-            for tp in self.twopaths:
-                key1 = (tp[0], tp[1])
-                key2 = (tp[1], tp[2])
-                # get key{1,2} with default value 0 from edge_list directory
-                edge_list[key1] = edge_list.get(key1, 0) + tp[3]
-                edge_list[key2] = edge_list.get(key2, 0) + tp[3]
+        else:
+            # Each unique two-path (s,v,d) contributes its weight to the links (s,v) and (v,d)
+            tp = self.twopaths
+            n = len(self.nodes)
+            keys = np.concatenate((tp.s.astype(np.int64) * n + tp.v, tp.v.astype(np.int64) * n + tp.d))
+            keys, inv = np.unique(keys, return_inverse=True)
+            weights = np.bincount(inv, weights=np.concatenate((tp.weight, tp.weight)), minlength=len(keys))
+            for k, w in zip(keys.tolist(), weights.tolist()):
+                edge_list[(k // n, k % n)] = w
             
         # adding all edges at once is much faster as igraph updates internal
         # data structures after each vertex/edge added
@@ -460,6 +870,11 @@ class TemporalNetwork:
            corresponding to this temporal network. This network corresponds to 
            a second-order Markov model reproducing both the link statistics and 
            (first-order) order correlations in the underlying temporal network.
+           Each second-order node corresponds to a first-order link (v,w), whose source and 
+           target are stored as the integer vertex attributes "source" and "target", i.e. as 
+           indices of v and w in the list of nodes (see secondOrderNodes). In addition, the vertex 
+           attribute "name" holds the readable name v-w joined by the separator character of this 
+           instance (see secondOrderNames).
            """
 
         if self.g2 != 0:
@@ -470,24 +885,24 @@ class TemporalNetwork:
 
         Log.add('Constructing second-order aggregate network ...')
 
-        # create vertex list and edge directory first
-        vertex_list = []
-        edge_dict = {}
-        sep = self.separator
-        for tp in self.twopaths:
-            n1 = str(tp[0])+sep+str(tp[1])
-            n2 = str(tp[1])+sep+str(tp[2])
-            vertex_list.append(n1)
-            vertex_list.append(n2)
-            key = (n1, n2)
-            edge_dict[key] = edge_dict.get(key, 0) + tp[3]
-            
-        # remove duplicate vertices by building a set
-        vertex_list = list(set(vertex_list))
+        # Each unique two-path (s,v,d) corresponds to a link between
+        # the second-order nodes (s,v) and (v,d)
+        tp = self.twopaths
+        n = len(self.nodes)
+        m = len(tp)
+        pairs = np.concatenate((tp.s.astype(np.int64) * n + tp.v, tp.v.astype(np.int64) * n + tp.d))
+        pairs, inv = np.unique(pairs, return_inverse=True)
+
+        edge_dict = dict(zip(zip(inv[:m].tolist(), inv[m:].tolist()), tp.weight.tolist()))
         
-        # build 2nd order graph
-        self.g2 = igraph.Graph( n=len(vertex_list), directed=True )
-        self.g2.vs["name"] = vertex_list
+        # build 2nd order graph, whose vertices are identified by the 
+        # indices of the source and target of the corresponding first-order links
+        self.g2 = igraph.Graph( n=len(pairs), directed=True )
+        self.g2.vs["source"] = (pairs // n).tolist()
+        self.g2.vs["target"] = (pairs % n).tolist()
+        self._g2nodes = None
+        self._g2index = None
+        self.g2.vs["name"] = self.secondOrderNames(self.g2)
         
         # add all edges in one go
         self.g2.add_edges( edge_dict.keys() )
@@ -498,6 +913,67 @@ class TemporalNetwork:
         return self.g2
 
 
+    def secondOrderNodes(self, g=None):
+        """Returns a tuple (source, target) of integer numpy arrays, which contain the indices 
+        (in the list of nodes, as well as in the first-order aggregate network) of the source 
+        and target of the first-order link corresponding to each vertex of a second-order network. 
+        For the cached second-order network, these arrays are cached.
+
+        @param g: a second-order network (or a subgraph of it, such as its strongly connected component 
+            or the null model) whose vertices carry the attributes "source" and "target". If None, 
+            the (cached) second-order network is used.
+        """
+        if g is None:
+            g = self.igraphSecondOrder()
+        if g is self.g2 and self._g2nodes is not None:
+            return self._g2nodes
+        nodes = (np.array(g.vs["source"], dtype=np.int64), np.array(g.vs["target"], dtype=np.int64))
+        if g is self.g2:
+            self._g2nodes = nodes
+        return nodes
+
+
+    def secondOrderNames(self, g=None):
+        """Returns a list of readable names v-w of all vertices of a second-order network, 
+        where the separator character of this instance is used to join node names.
+
+        @param g: a second-order network, whose vertices carry the attributes "source" and "target". 
+            If None, the (cached) second-order network is used.
+        """
+        source, target = self.secondOrderNodes(g)
+        nodes = self.nodes
+        sep = self.separator
+        return [str(nodes[v])+sep+str(nodes[w]) for v, w in zip(source.tolist(), target.tolist())]
+
+
+    def projectionMatrix(self, g=None, projection='TARGET'):
+        """Returns a sparse matrix P of shape (n1, n2), where n1 is the number of first-order nodes and 
+        n2 is the number of vertices of a second-order network. An entry P[v,i] is one if first-order node v 
+        is the target (projection TARGET) or the source (projection SOURCE) of the link corresponding to 
+        second-order node i, and zero otherwise. For a vector x of values of second-order nodes, P.dot(x) 
+        aggregates these values to first-order nodes. Projection matrices are cached until two-paths are invalidated.
+
+        @param g: a second-order network, whose vertices carry the attributes "source" and "target". 
+            If None, the (cached) second-order network is used.
+        @param projection: either C{"TARGET"} or C{"SOURCE"}, where C{"TARGET"} is the default value.
+        """
+        assert projection == 'SOURCE' or projection == 'TARGET'
+
+        if g is None:
+            g = self.igraphSecondOrder()
+
+        key = (id(g), projection)
+        cached = self._projections.get(key)
+        if cached is not None and cached[0] is g and cached[1].shape == (len(self.nodes), g.vcount()):
+            return cached[1]
+
+        source, target = self.secondOrderNodes(g)
+        index = target if projection == 'TARGET' else source
+        P = sparse.csr_matrix((np.ones(len(index)), (index, np.arange(len(index)))), shape=(len(self.nodes), len(index)))
+        self._projections[key] = (g, P)
+        return P
+
+
     def igraphSecondOrderNull(self):
         """Returns a second-order null Markov model 
            corresponding to the first-order aggregate network. This network
@@ -508,55 +984,131 @@ class TemporalNetwork:
         if self.g2n != 0:
             return self.g2n
 
-        g2 = self.igraphSecondOrder().components(mode='STRONG').giant()
+        g2 = self.getSCC('SECOND')
         n_vertices = len(g2.vs)
 
         if n_vertices<=1:
             Log.add('Strongly connected component is empty for delta = ' + str(self.delta), Severity.ERROR)
             raise EmptySCCError()
         
-        T = RWTransitionMatrix( g2 )
-        pi = StationaryDistribution(T)
+        T = self.getTransitionMatrix('SECOND')
+        pi = self.getStationaryDistribution('SECOND')
         
-        # Construct null model second-order network
-        self.g2n = igraph.Graph(directed=True)
+        # The null model contains a link (a,b) -> (b,c) for each pair of second-order nodes which 
+        # share the middle node b, weighted by the stationary probability of (b,c)
+        src, tgt = self.secondOrderNodes(g2)
+
+        # Group second-order nodes by their first node, such that the nodes (b,*) are 
+        # stored in by_src[lo[b]:hi[b]]
+        by_src = np.argsort(src, kind='mergesort')
+        sorted_src = src[by_src]
+        lo = np.searchsorted(sorted_src, tgt, side='left')
+        num = np.searchsorted(sorted_src, tgt, side='right') - lo
+
+        # Expand each node (a,b) into all nodes (b,*)
+        e1 = np.repeat(np.arange(n_vertices), num)
+        offsets = np.arange(len(e1)) - np.repeat(np.cumsum(num) - num, num)
+        e2 = by_src[np.repeat(lo, num) + offsets]
+
+        w = np.abs(pi)[e2]
+        mask = (w > 0) & (e1 != e2)
+
+        # Construct null model second-order network, whose vertices are ordered 
+        # in the same way as in the empirical second-order network
+        self.g2n = igraph.Graph(n=n_vertices, directed=True)
+        self.g2n.vs["source"] = g2.vs["source"]
+        self.g2n.vs["target"] = g2.vs["target"]
+        self.g2n.vs["name"] = g2.vs["name"]
 
-        # This ensures that vertices are ordered in the same way as in the empirical second-order network
-        for v in g2.vs():
-            self.g2n.add_vertex(name=v["name"])
-        
-        ## TODO: This operation is the bottleneck for large data sets. We should only iterate over those edge pairs, that actually are two-paths
-        edge_dict = {}
-        vertices = g2.vs()
-        sep = self.separator
-        for i in range(n_vertices):
-            e1 = vertices[i]
-            e1name = e1["name"]
-            a,b = e1name.split(sep)
-            for j in range(i+1, n_vertices):
-                e2 = vertices[j]
-                e2name = e2["name"]
-                a_,b_ = e2name.split(sep)
-                
-                # Check whether this pair of nodes in the second-order 
-                # network is a *possible* forward two-path
-                if b == a_:
-                    w = np.abs(pi[e2.index])
-                    if w>0:
-                        edge_dict[(e1name, e2name)] = w
-                        
-                if b_ == a:
-                    w = np.abs(pi[e1.index])
-                    if w>0:
-                        edge_dict[(e2name, e1name)] = w
-        
         # add all edges to the graph in one go
-        self.g2n.add_edges( edge_dict.keys() )
-        self.g2n.es["weight"] = list(edge_dict.values())
+        self.g2n.add_edges( list(zip(e1[mask].tolist(), e2[mask].tolist())) )
+        self.g2n.es["weight"] = w[mask].tolist()
         
         return self.g2n
 
 
+    def _spectralData(self, model, key, compute):
+        """Returns the spectral data with the given key for the given model, which is computed 
+        by calling compute() on first access and cached until two-paths are invalidated"""
+        assert model == 'FIRST' or model == 'SECOND' or model == 'NULL'
+        cache = self._spectral.setdefault(model, {})
+        if key not in cache:
+            cache[key] = compute()
+        return cache[key]
+
+
+    def getSCC(self, model='SECOND'):
+        """Returns the largest strongly connected component of the first-order (model=FIRST), 
+        second-order (model=SECOND) or second-order null (model=NULL) aggregate network. 
+        The component is cached until two-paths are invalidated.
+
+        @param model: either C{"FIRST"}, C{"SECOND"} or C{"NULL"}, where C{"SECOND"} is the default value.
+        """
+        def compute():
+            if model == 'FIRST':
+                g = self.igraphFirstOrder()
+            elif model == 'SECOND':
+                g = self.igraphSecondOrder()
+            else:
+                g = self.igraphSecondOrderNull()
+            return g.components(mode='STRONG').giant()
+        return self._spectralData(model, 'scc', compute)
+
+
+    def getTransitionMatrix(self, model='SECOND'):
+        """Returns the (cached) transposed random walk transition matrix of the largest strongly 
+        connected component of the given model (see getSCC). The returned matrix must not be modified.
+
+        @param model: either C{"FIRST"}, C{"SECOND"} or C{"NULL"}, where C{"SECOND"} is the default value.
+        """
+        return self._spectralData(model, 'T', lambda: RWTransitionMatrix(self.getSCC(model)))
+
+
+    def getStationaryDistribution(self, model='SECOND'):
+        """Returns the (cached) normalized stationary distribution of the transition matrix 
+        of the given model (see getTransitionMatrix).
+
+        @param model: either C{"FIRST"}, C{"SECOND"} or C{"NULL"}, where C{"SECOND"} is the default value.
+        """
+        return self._spectralData(model, 'pi', lambda: StationaryDistribution(self.getTransitionMatrix(model)))
+
+
+    def getLeadingEigenvalues(self, model='SECOND'):
+        """Returns the (cached) two eigenvalues with the largest magnitude of the transition 
+        matrix of the given model (see getTransitionMatrix).
+
+        @param model: either C{"FIRST"}, C{"SECOND"} or C{"NULL"}, where C{"SECOND"} is the default value.
+        """
+        # NOTE: ncv=13 sets additional auxiliary eigenvectors that are computed
+        # NOTE: in order to be more confident to find the one with the largest
+        # NOTE: magnitude, see
+        # NOTE: https://github.com/scipy/scipy/issues/4987
+        return self._spectralData(model, 'evals', 
+            lambda: sla.eigs(self.getTransitionMatrix(model), which="LM", k=2, ncv=13, return_eigenvectors=False))
+
+
+    def getLaplacian(self, model='SECOND'):
+        """Returns the (cached) transposed Laplacian matrix I-T, where T is the transition matrix 
+        of the given model (see getTransitionMatrix). The returned matrix must not be modified.
+
+        @param model: either C{"FIRST"}, C{"SECOND"} or C{"NULL"}, where C{"SECOND"} is the default value.
+        """
+        def compute():
+            T = self.getTransitionMatrix(model)
+            return sparse.identity(T.shape[0]) - T
+        return self._spectralData(model, 'L', compute)
+
+
+    def getLaplacianEigenvalues(self, model='SECOND'):
+        """Returns the (cached) two eigenvalues with the smallest magnitude of the 
+        Laplacian matrix of the given model (see getLaplacian).
+
+        @param model: either C{"FIRST"}, C{"SECOND"} or C{"NULL"}, where C{"SECOND"} is the default value.
+        """
+        return self._spectralData(model, 'L_evals', 
+            lambda: sla.eigs(self.getLaplacian(model), which="SM", k=2, ncv=13, return_eigenvectors=False))
+
+
     def ShuffleEdges(self, l=0, with_replacement=True):        
         """Generates a shuffled version of the temporal network in which edge statistics (i.e.
         the frequencies of time-stamped edges) are preserved, while all order correlations are 
@@ -593,10 +1145,14 @@ class TemporalNetwork:
             tedges.append( (edge[0], edge[1], i) )
 
         # Generate temporal network
-        t = TemporalNetwork(sep=self.separator, tedges=tedges)
+        if self.storage == 'ARRAY':
+            # Fix node ids to correspond to original network
+            t = TemporalNetwork(sep=self.separator, tedges=EdgeArrays.edgeArraysFromTEdges(tedges, nodes=list(self.nodes)), storage='ARRAY')
+        else:
+            t = TemporalNetwork(sep=self.separator, tedges=tedges)
 
-        # Fix node order to correspond to original network
-        t.nodes = self.nodes
+            # Fix node order to correspond to original network
+            t.nodes = self.nodes
             
         return t
         
@@ -637,5 +1193,5 @@ class TemporalNetwork:
             tedges.append((tp[1], tp[2], t))
             t += 1
             
-        tempnet = TemporalNetwork(sep=',', tedges=tedges)
+        tempnet = TemporalNetwork(sep=',', tedges=tedges, storage=self.storage)
         return tempnet
\ No newline at end of file
@@ -0,0 +1,550 @@
+# -*- coding: utf-8 -*-
+"""
+Extraction and aggregated storage of time-respecting paths of length two
+(two-paths), including multi-delta, parallel and streaming extraction.
+"""
+
+import multiprocessing
+import numpy as np
+
+from collections import defaultdict
+from collections import deque
+from collections.abc import Sequence
+
+from pyTempNet.Log import *
+
+
+def _joinTwoPaths(ea, delta, chunksize, n_in=None):
+    """Generator performing a sorted join of in-edges (s,v;t) and out-edges (v,d;t') on the middle node v, 
+    where t < t' <= t+delta. For chunks of at most (approximately) chunksize two-paths, this generator yields 
+    a tuple of arrays (e_in, e_out, weight) containing the positions of the first and second link of each 
+    two-path in the edge arrays, as well as the two-path weights 1/(indeg*outdeg). If n_in is given, only 
+    the first n_in links are used as first links of two-paths."""
+    ea.flush()
+    src = ea.src
+    dst = ea.dst
+    time_values = ea.time_values
+    n_times = np.int64(len(time_values))
+
+    # Rank of the time stamp of each link in the ordered sequence of time stamps
+    rank = np.repeat(np.arange(n_times, dtype=np.int64), np.diff(ea.time_ptr))
+
+    # Sort links by (target, time) and (source, time), and count the number of
+    # links (*,v;t) and (v,*;t) for the target and source v of each link
+    in_key = dst.astype(np.int64) * n_times + rank
+    in_ix, indeg = _groupSizes(in_key)
+    out_key = src.astype(np.int64) * n_times + rank
+    out_ix, outdeg = _groupSizes(out_key)
+
+    # Links (v,v;t) count for the degrees, but do not continue time-respecting paths.
+    # In-edges are processed ordered by middle node and time, so that all searches
+    # below are performed for sorted keys
+    in_ix = in_ix[src[in_ix] != dst[in_ix]]
+    if n_in is not None:
+        in_ix = in_ix[in_ix < n_in]
+    in_sorted = in_key[in_ix]
+    out_ix = out_ix[src[out_ix] != dst[out_ix]]
+    out_sorted = out_key[out_ix]
+
+    # Rank of the largest time stamp t' with t' <= t+delta for each time stamp t
+    max_rank = np.searchsorted(time_values, time_values + delta, side='right')
+
+    # For each in-edge (s,v;t), out-edges (v,*;t') with t < t' <= t+delta are
+    # stored in the range [lo, hi) of the sorted out-edges
+    r = rank[in_ix]
+    lo = np.searchsorted(out_sorted, in_sorted + 1, side='left')
+    hi = np.searchsorted(out_sorted, in_sorted - r + max_rank[r], side='left')
+    num = hi - lo
+
+    # Split in-edges into chunks which generate at most chunksize two-paths each
+    ends = np.cumsum(num)
+    splits = np.searchsorted(ends, np.arange(chunksize, ends[-1] if len(ends) > 0 else 0, chunksize), side='right')
+    bounds = [0] + list(splits) + [len(in_ix)]
+
+    for i in range(len(bounds)-1):
+        a = bounds[i]
+        b = bounds[i+1]
+        if b <= a:
+            continue
+        c = num[a:b]
+        total = c.sum()
+        if total == 0:
+            continue
+
+        # Expand each in-edge into all of its matching out-edges
+        e_in = np.repeat(in_ix[a:b], c)
+        offsets = np.arange(total, dtype=np.int64) - np.repeat(np.cumsum(c) - c, c)
+        e_out = out_ix[np.repeat(lo[a:b], c) + offsets]
+
+        yield e_in, e_out, 1. / (indeg[e_in] * outdeg[e_out])
+
+
+def extractTwoPathArrays(ea, delta, chunksize=2**22):
+    """Extracts all time-respecting paths of length two from a columnar representation of
+    time-stamped links, by means of a sorted join of in-edges (s,v;t) and out-edges (v,d;t') on the middle
+    node v, where t < t' <= t+delta. Each two-path is weighted by 1/(indeg*outdeg), where indeg is the
+    number of links (*,v;t) and outdeg is the number of links (v,*;t'). This function returns a tuple of
+    numpy arrays (s, v, d, weight, time) containing the integer ids of source, middle and target nodes,
+    the weights and the time stamps t of the first link of all two-paths.
+
+    @param ea: the EdgeArrays instance containing the time-stamped links
+    @param delta: the maximum time difference between consecutive links of a two-path
+    @param chunksize: the maximum number of two-paths to be generated in one vectorized step.
+        This parameter limits the size of temporary arrays.
+    """
+    result = ([], [], [], [], [])
+    for e_in, e_out, w in _joinTwoPaths(ea, delta, chunksize):
+        result[0].append(ea.src[e_in])
+        result[1].append(ea.dst[e_in])
+        result[2].append(ea.dst[e_out])
+        result[3].append(w)
+        result[4].append(ea.times[e_in])
+
+    if len(result[0]) == 0:
+        return (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32),
+            np.zeros(0, dtype=np.float64), np.zeros(0, dtype=ea.times.dtype))
+    return tuple(np.concatenate(x) for x in result)
+
+
+def sweepTwoPaths(ea, deltas, chunksize=2**22):
+    """Extracts time-respecting paths of length two for multiple maximum time differences in a single 
+    pass over the time-stamped links. Since the weight of a two-path does not depend on delta, and since the 
+    window (t, t+delta] contains the windows of all smaller deltas, two-paths are extracted once for the 
+    largest delta, and each occurrence is assigned to the smallest delta for which it is time-respecting. 
+    Accumulated weights and counts for all deltas are then obtained by cumulative sums. This function returns 
+    a dictionary which maps each delta to a TwoPathStore.
+
+    @param ea: the EdgeArrays instance containing the time-stamped links
+    @param deltas: a list of maximum time differences
+    @param chunksize: the maximum number of two-paths to be generated in one vectorized step.
+    """
+    deltas = np.unique(deltas)
+    k = len(deltas)
+
+    s = []
+    v = []
+    d = []
+    w = []
+    bucket = []
+    for e_in, e_out, weight in _joinTwoPaths(ea, deltas[-1], chunksize):
+        s.append(ea.src[e_in])
+        v.append(ea.dst[e_in])
+        d.append(ea.dst[e_out])
+        w.append(weight)
+        # Index of the smallest delta for which t'-t <= delta
+        bucket.append(np.searchsorted(deltas, ea.times[e_out] - ea.times[e_in], side='left'))
+
+    if len(s) == 0:
+        empty = aggregateTwoPaths(ea.nodes, np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0))
+        return dict((delta, empty) for delta in deltas.tolist())
+
+    s = np.concatenate(s)
+    v = np.concatenate(v)
+    d = np.concatenate(d)
+    w = np.concatenate(w)
+    bucket = np.concatenate(bucket)
+
+    # Accumulate weights and counts per unique two-path and delta
+    order, starts, group = _groupTriples(s, v, d)
+    m = len(starts)
+    key = group * k + bucket[order]
+    weights = np.cumsum(np.bincount(key, weights=w[order], minlength=m*k).reshape(m, k), axis=1)
+    counts = np.cumsum(np.bincount(key, minlength=m*k).reshape(m, k), axis=1)
+    s = s[order][starts]
+    v = v[order][starts]
+    d = d[order][starts]
+
+    stores = {}
+    for i in range(k):
+        mask = counts[:, i] > 0
+        stores[deltas[i].item()] = TwoPathStore(ea.nodes, s[mask], v[mask], d[mask], weights[mask, i], counts[mask, i],
+            _occurrencesFunction(ea, deltas[i].item()))
+    return stores
+
+
+def extractTwoPathsParallel(ea, delta, workers, blocks_per_worker=4):
+    """Extracts and aggregates all time-respecting paths of length two using a pool of worker processes. 
+    Time-stamped links are split into blocks of consecutive time stamps containing similar numbers of links. 
+    Each block is extended by all links within delta time units after its last time stamp, so that the 
+    two-paths whose first link lies in the block can be extracted independently from all other blocks. 
+    Workers share the read-only edge arrays and return partially aggregated two-paths, which are merged 
+    into a TwoPathStore.
+
+    @param ea: the EdgeArrays instance containing the time-stamped links
+    @param delta: the maximum time difference between consecutive links of a two-path
+    @param workers: the number of worker processes
+    @param blocks_per_worker: the number of time blocks per worker, which helps to balance the load 
+        if two-paths are not evenly distributed in time
+
+    Since the edge arrays are shared with worker processes by forking the main process, two-paths are 
+    extracted in the main process on platforms which do not support the fork start method.
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        Log.add('Worker processes require the fork start method, extracting two-paths in a single process', Severity.WARNING)
+        s, v, d, w, t = extractTwoPathArrays(ea, delta)
+        return aggregateTwoPaths(ea.nodes, s, v, d, w, _occurrencesFunction(ea, delta))
+
+    ea.flush()
+    m = len(ea.src)
+    n_blocks = max(1, min(workers * blocks_per_worker, len(ea.time_values)))
+
+    # Boundaries of blocks in terms of ranks of time stamps
+    cuts = np.unique(np.searchsorted(ea.time_ptr, np.linspace(0, m, n_blocks+1).astype(np.int64), side='left'))
+    ext = np.searchsorted(ea.time_values, ea.time_values[cuts[1:]-1] + delta, side='right')
+    tasks = list(zip(cuts[:-1].tolist(), cuts[1:].tolist(), ext.tolist()))
+
+    context = multiprocessing.get_context('fork')
+    with context.Pool(workers, initializer=_initWorker, initargs=(ea, delta)) as pool:
+        parts = pool.map(_extractBlock, tasks)
+
+    s, v, d, w, count = (np.concatenate([p[i] for p in parts]) for i in range(5))
+    order, starts, group = _groupTriples(s, v, d)
+    return TwoPathStore(ea.nodes, s[order][starts], v[order][starts], d[order][starts], 
+        np.bincount(group, weights=w[order], minlength=len(starts)), 
+        np.bincount(group, weights=count[order], minlength=len(starts)).astype(np.int64), 
+        _occurrencesFunction(ea, delta))
+
+
+# Edge arrays and delta shared with the processes of a worker pool (see extractTwoPathsParallel)
+_shared = None
+
+
+def _initWorker(ea, delta):
+    """Initializes a worker process with the shared edge arrays"""
+    global _shared
+    _shared = (ea, delta)
+
+
+def _extractBlock(task):
+    """Extracts and aggregates all two-paths whose first link has a time stamp with rank in [r0, r1), 
+    using the links with time stamps of ranks in [r0, r2). Returns a tuple of arrays (s, v, d, weight, count)."""
+    r0, r1, r2 = task
+    ea, delta = _shared
+    a = ea.time_ptr[r0]
+    b = ea.time_ptr[r1]
+    c = ea.time_ptr[r2]
+
+    # A view on the links of this block, including its extension
+    block = _EdgeBlock(ea.src[a:c], ea.dst[a:c], ea.time_values[r0:r2], ea.time_ptr[r0:r2+1] - a)
+
+    s = []
+    v = []
+    d = []
+    w = []
+    for e_in, e_out, weight in _joinTwoPaths(block, delta, 2**22, n_in=b-a):
+        s.append(block.src[e_in])
+        v.append(block.dst[e_in])
+        d.append(block.dst[e_out])
+        w.append(weight)
+    if len(s) == 0:
+        empty = np.zeros(0, dtype=np.int32)
+        return (empty, empty, empty, np.zeros(0), np.zeros(0, dtype=np.int64))
+
+    s = np.concatenate(s)
+    v = np.concatenate(v)
+    d = np.concatenate(d)
+    order, starts, group = _groupTriples(s, v, d)
+    return (s[order][starts], v[order][starts], d[order][starts], 
+        np.bincount(group, weights=np.concatenate(w)[order], minlength=len(starts)), 
+        np.diff(np.append(starts, len(order))))
+
+
+class _EdgeBlock:
+    """A minimal, time-ordered block of edge arrays as used by _joinTwoPaths"""
+
+    def __init__(self, src, dst, time_values, time_ptr):
+        self.src = src
+        self.dst = dst
+        self.time_values = time_values
+        self.time_ptr = time_ptr
+
+    def flush(self):
+        pass
+
+
+def _occurrencesFunction(ea, delta):
+    """Returns a function that recomputes all occurrences of two-paths for a given delta"""
+    return lambda: extractTwoPathArrays(ea, delta)
+
+
+def _groupSizes(keys):
+    """Returns a stable ordering of the given keys, as well as an array containing,
+    for each element, the number of elements with the same key"""
+    order = np.argsort(keys, kind='mergesort')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    counts = np.diff(np.append(starts, len(keys)))
+    sizes = np.empty(len(keys), dtype=np.int64)
+    sizes[order] = np.repeat(counts, counts)
+    return order, sizes
+
+
+class TwoPathStore(Sequence):
+    """A compact store of two-paths, in which each unique two-path (s,v,d) is stored once, together with 
+    its accumulated weight and the number of its occurrences. Source, middle and target nodes are stored as 
+    integer ids, i.e. as indices in a list of node names. As a sequence, this class provides weighted two-path 
+    tuples (s, v, d, weight) based on node names."""
+
+    def __init__(self, nodes, s, v, d, weight, count, occurrences=None):
+        """Constructor generating a two-path store
+
+        @param nodes: the list of node names, whose indices are used as integer node ids
+        @param s: array of integer ids of source nodes
+        @param v: array of integer ids of middle nodes
+        @param d: array of integer ids of target nodes
+        @param weight: array of accumulated weights
+        @param count: array of occurrence counts
+        @param occurrences: either a tuple of arrays (s, v, d, weight, time) containing all individual 
+            occurrences of two-paths, or a function without arguments that returns such a tuple. If None, 
+            no per-time information is available.
+        """
+        self.nodes = nodes
+        self.s = s
+        self.v = v
+        self.d = d
+        self.weight = weight
+        self.count = count
+        self.occurrences = occurrences
+
+    def __len__(self):
+        return len(self.s)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        nodes = self.nodes
+        return (nodes[self.s[i]], nodes[self.v[i]], nodes[self.d[i]], self.weight[i].item())
+
+    def __iter__(self):
+        nodes = self.nodes
+        for s, v, d, w in zip(self.s.tolist(), self.v.tolist(), self.d.tolist(), self.weight.tolist()):
+            yield (nodes[s], nodes[v], nodes[d], w)
+
+    def totalCount(self):
+        """Returns the total number of occurrences of all two-paths"""
+        return int(self.count.sum())
+
+    def select(self, keep):
+        """Returns a TwoPathStore containing the two-paths at all positions i for which keep[i] is True, 
+        along with their accumulated weights and occurrence counts. Occurrences are filtered accordingly.
+
+        @param keep: boolean array with one entry per unique two-path
+        """
+        keep = np.asarray(keep, dtype=bool)
+        occurrences = None
+        if self.occurrences is not None:
+            n = len(self.nodes)
+            kept = _tripleKeys(self.s[keep], self.v[keep], self.d[keep], n)
+            def occurrences():
+                s, v, d, w, t = self.getOccurrences()
+                mask = np.isin(_tripleKeys(s, v, d, n), kept)
+                return s[mask], v[mask], d[mask], w[mask], t[mask]
+        return TwoPathStore(self.nodes, self.s[keep], self.v[keep], self.d[keep], self.weight[keep], self.count[keep], occurrences)
+
+    def relabel(self, nodes, ids):
+        """Returns a TwoPathStore referring to another list of node names, along with the same 
+        weights and occurrence counts
+
+        @param nodes: the list of node names used by the new store
+        @param ids: array in which entry i is the index of the i-th node of this store in nodes
+        """
+        occurrences = None
+        if self.occurrences is not None:
+            def occurrences():
+                s, v, d, w, t = self.getOccurrences()
+                return ids[s], ids[v], ids[d], w, t
+        return TwoPathStore(nodes, ids[self.s], ids[self.v], ids[self.d], self.weight, self.count, occurrences)
+
+    def getOccurrences(self):
+        """Returns a tuple of arrays (s, v, d, weight, time) containing all individual occurrences
+        of two-paths, where time is the time stamp of the first link of each two-path. If occurrences 
+        are not stored, they are recomputed."""
+        if self.occurrences is None:
+            raise ValueError('Two-path store does not contain per-time information')
+        if callable(self.occurrences):
+            return self.occurrences()
+        return self.occurrences
+
+
+def aggregateTwoPaths(nodes, s, v, d, weight, occurrences=None):
+    """Aggregates individual occurrences of two-paths to a TwoPathStore, in which each unique 
+    two-path (s,v,d) is stored once, with accumulated weight and occurrence count.
+
+    @param nodes: the list of node names, whose indices are used as integer node ids
+    @param s: array of integer ids of source nodes
+    @param v: array of integer ids of middle nodes
+    @param d: array of integer ids of target nodes
+    @param weight: array of weights of two-paths
+    @param occurrences: per-time information passed on to the TwoPathStore (see there)
+    """
+    order, starts, group = _groupTriples(s, v, d)
+    w = np.bincount(group, weights=weight[order], minlength=len(starts))
+    count = np.diff(np.append(starts, len(order)))
+    return TwoPathStore(nodes, s[order][starts], v[order][starts], d[order][starts], w, count, occurrences)
+
+
+def _tripleKeys(s, v, d, n):
+    """Returns a unique integer key for each two-path (s,v,d) with node ids smaller than n"""
+    return (s.astype(np.int64) * n + v) * n + d
+
+
+def _groupTriples(s, v, d):
+    """Sorts two-paths by (v, s, d) and returns a tuple (order, starts, group), where order is the 
+    sorting permutation, starts contains the positions of the first occurrence of each unique two-path 
+    in the sorted arrays, and group contains the index of the unique two-path for each sorted element."""
+    order = np.lexsort((d, s, v))
+    ss = s[order]
+    sv = v[order]
+    sd = d[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (sv[1:] != sv[:-1]) | (ss[1:] != ss[:-1]) | (sd[1:] != sd[:-1])
+    return order, np.flatnonzero(first), np.cumsum(first) - 1
+
+
+class TwoPathStream:
+    """A streaming extractor of time-respecting paths of length two, which consumes time-stamped links 
+    in order of their time stamps. Rather than storing all time-stamped links, only links (*,v;t) within 
+    the last delta time units are buffered for each node v, so that memory consumption is proportional to 
+    the number of links in the sliding time window (plus the number of unique two-paths if two-paths 
+    are aggregated). Two-paths (s,v,d) are weighted by 1/(indeg*outdeg) as in extractTwoPathArrays."""
+
+    def __init__(self, delta=1, callback=None, aggregate=True):
+        """Constructor generating a streaming two-path extractor
+
+        @param delta: the maximum time difference between consecutive links of a two-path
+        @param callback: an optional function callback(s, v, d, weight, time) which is called for each 
+            occurrence of a two-path as soon as it is closed, where time is the time stamp of its first link
+        @param aggregate: whether or not to accumulate weights and occurrence counts of unique two-paths 
+            (see getTwoPaths)
+        """
+        self.delta = delta
+        self.callback = callback
+        self.aggregate = aggregate
+
+        # Number of consumed time-stamped links and extracted two-paths
+        self.ecount = 0
+        self.tpcount = 0
+
+        # Accumulated weights and counts [weight, count] of unique two-paths (s,v,d)
+        self.weights = {}
+
+        # For each node v, a queue of tuples (t, indeg, sources) for all time stamps t within the 
+        # window, where indeg is the number of links (*,v;t) and sources are the sources of all links (s,v;t) with s!=v
+        self._window = defaultdict( lambda: deque() )
+
+        # A queue of tuples (t, v) in the order in which entries have been added to the window
+        self._expiry = deque()
+
+        # Links with the current time stamp, which are joined with the window once all of them have been consumed
+        self._t = None
+        self._batch = []
+
+
+    def addEdge(self, source, target, ts):
+        """Consumes a time-stamped link (source,target;ts). Links must be consumed in non-decreasing 
+        order of time stamps.
+
+        @param source: the source node of the time-stamped link
+        @param target: the target node of the time-stamped link
+        @param ts: the time stamp of the time-stamped link
+        """
+        if self._t is not None and ts != self._t:
+            if ts < self._t:
+                Log.add('Time-stamped links must be ordered by time: ' + str(ts) + ' < ' + str(self._t), Severity.ERROR)
+                raise ValueError('Time-stamped links must be ordered by time')
+            self._processBatch()
+        self._t = ts
+        self._batch.append((source, target))
+        self.ecount += 1
+
+
+    def addEdges(self, tedges):
+        """Consumes an iterable of time-stamped links (source,target,time) ordered by time"""
+        for e in tedges:
+            self.addEdge(e[0], e[1], e[2])
+
+
+    def flush(self):
+        """Processes all consumed links. This method needs to be called after the last link 
+        has been consumed, before accessing two-path counts or aggregated weights."""
+        if len(self._batch) > 0:
+            self._processBatch()
+
+
+    def _processBatch(self):
+        """Joins the links (v,*;t) with the current time stamp t with the links (*,v;t') in the 
+        window, where t-delta <= t' < t, and adds the links (*,v;t) to the window."""
+        t = self._t
+        window = self._window
+
+        # Remove links from the window which cannot be continued any more
+        expiry = self._expiry
+        while len(expiry) > 0 and expiry[0][0] < t - self.delta:
+            w = expiry.popleft()[1]
+            window[w].popleft()
+            if len(window[w]) == 0:
+                del window[w]
+
+        out_edges = defaultdict( lambda: list() )
+        in_edges = defaultdict( lambda: list() )
+        for (s, d) in self._batch:
+            out_edges[s].append(d)
+            in_edges[d].append(s)
+
+        weights = self.weights
+        callback = self.callback
+        for v, targets in out_edges.items():
+            if v not in window:
+                continue
+            outdeg = len(targets)
+            targets = [d for d in targets if d != v]
+            for (t_in, indeg, sources) in window[v]:
+                w = 1. / (indeg * outdeg)
+                for s in sources:
+                    for d in targets:
+                        self.tpcount += 1
+                        if self.aggregate:
+                            x = weights.get((s, v, d))
+                            if x is None:
+                                weights[(s, v, d)] = [w, 1]
+                            else:
+                                x[0] += w
+                                x[1] += 1
+                        if callback is not None:
+                            callback(s, v, d, w, t_in)
+
+        for v, sources in in_edges.items():
+            window[v].append((t, len(sources), [s for s in sources if s != v]))
+            expiry.append((t, v))
+
+        self._batch = []
+
+
+    def windowSize(self):
+        """Returns the number of links (*,v;t) currently buffered in the sliding window"""
+        return sum(x[1] for q in self._window.values() for x in q)
+
+
+    def getTwoPaths(self):
+        """Processes all consumed links and returns a TwoPathStore containing the unique two-paths 
+        (s,v,d) extracted so far, along with their accumulated weights and occurrence counts. Node ids 
+        in the store refer to the list of nodes occurring in two-paths. Per-time information is not stored."""
+        self.flush()
+        nodes = []
+        node_ids = {}
+        ids = np.zeros(shape=(len(self.weights), 3), dtype=np.int32)
+        weight = np.zeros(len(self.weights))
+        count = np.zeros(len(self.weights), dtype=np.int64)
+        i = 0
+        for tp, x in self.weights.items():
+            for j in range(3):
+                k = node_ids.get(tp[j], -1)
+                if k < 0:
+                    k = node_ids[tp[j]] = len(nodes)
+                    nodes.append(tp[j])
+                ids[i, j] = k
+            weight[i] = x[0]
+            count[i] = x[1]
+            i += 1
+        order = np.lexsort((ids[:,2], ids[:,0], ids[:,1]))
+        return TwoPathStore(nodes, ids[order,0], ids[order,1], ids[order,2], weight[order], count[order])
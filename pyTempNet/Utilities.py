@@ -15,12 +15,18 @@ from collections import defaultdict
 
 import pyTempNet as tn
 import datetime as dt
+import time
+
+from array import array
+
+from pyTempNet.EdgeArrays import EdgeArrays
+from pyTempNet.TwoPaths import TwoPathStream
 
 from pyTempNet.Log import *
 
 import sys
 
-def readFile(filename, sep=',', fformat="TEDGE", timestampformat="%s", maxlines=sys.maxsize):
+def readFile(filename, sep=',', fformat="TEDGE", timestampformat="%s", maxlines=sys.maxsize, storage='DICT'):
     """ Reads time-stamped edges from TEDGE or TRIGRAM file. If fformat is TEDGES,
         the file is expected to contain lines in the format 'v,w,t' each line 
         representing a directed time-stamped link from v to w at time t.
@@ -30,6 +36,8 @@ def readFile(filename, sep=',', fformat="TEDGE", timestampformat="%s", maxlines=
         'u,v,w' each line representing a time-respecting path (u,v) -> (v,w) consisting 
         of two consecutive links (u,v) and (v,w). Timestamps can be integer numbers or
         string timestamps (in which case the timestampformat string is used for parsing)
+        For storage ARRAY, time-stamped edges are directly read into integer arrays, without 
+        generating a tuple for each time-stamped edge (see TemporalNetwork).
     """
     
     assert filename is not ""
@@ -38,6 +46,13 @@ def readFile(filename, sep=',', fformat="TEDGE", timestampformat="%s", maxlines=
     with open(filename, 'r') as f:
         tedges = []
         twopaths = []
+
+        if storage == 'ARRAY':
+            edgearrays = EdgeArrays()
+            node_id = edgearrays.nodeId
+            src = array('i')
+            dst = array('i')
+            times = array('q')
         
         header = f.readline()
         header = header.split(sep)
@@ -49,14 +64,7 @@ def readFile(filename, sep=',', fformat="TEDGE", timestampformat="%s", maxlines=
         weight_ix = -1
         target_ix = -1
         if fformat =="TEDGE":
-            for i in range(len(header)):
-                header[i] = header[i].strip()
-                if header[i] == 'node1' or header[i] == 'source':
-                    source_ix = i
-                elif header[i] == 'node2' or header[i] == 'target':
-                    target_ix = i
-                elif header[i] == 'time' or header[i] == 'timestamp':
-                    time_ix = i
+            source_ix, target_ix, time_ix = _getTEdgeColumns(header)
         elif fformat =="TRIGRAM":
             # For trigram files, we assume a default of (unweighted) trigrams in the form source;mid;target
             # Any other ordering, as well as the additional inclusion of weights requires the definition of 
@@ -94,15 +102,17 @@ def readFile(filename, sep=',', fformat="TEDGE", timestampformat="%s", maxlines=
             if fformat =="TEDGE":
                 try:
                     if time_ix >=0:
-                        timestamp = fields[time_ix]            
-                        if timestamp.isdigit():
-                            t = int(timestamp)
-                        else:
-                            x = dt.datetime.strptime(timestamp, "%Y-%m-%d %H:%M")
-                            t = int(time.mktime(x.timetuple()))
+                        t = _parseTimestamp(fields[time_ix])
                     else:
                         t = n                
-                    if t>=0:
+                    if t>=0 and storage == 'ARRAY':
+                        # Parse all fields before appending, so that the columns stay aligned for malformed lines
+                        v = fields[source_ix]
+                        w = fields[target_ix]
+                        src.append(node_id(v))
+                        dst.append(node_id(w))
+                        times.append(t)
+                    elif t>=0:
                         tedge = (fields[source_ix], fields[target_ix], t)
                         tedges.append(tedge)
                     else:
@@ -126,7 +136,10 @@ def readFile(filename, sep=',', fformat="TEDGE", timestampformat="%s", maxlines=
     # end of with open()
     
     Log.add('finished.')
-    if fformat == "TEDGE":        
+    if fformat == "TEDGE" and storage == 'ARRAY':
+        edgearrays._build(np.frombuffer(src, dtype=np.int32), np.frombuffer(dst, dtype=np.int32), np.frombuffer(times, dtype=np.int64))
+        return tn.TemporalNetwork(tedges = edgearrays, sep=sep, storage=storage)
+    elif fformat == "TEDGE":        
         return tn.TemporalNetwork(tedges = tedges, sep=sep)
     elif fformat =="TRIGRAM":
         # If trigram data did not contain a weight column, we aggregate
@@ -141,7 +154,77 @@ def readFile(filename, sep=',', fformat="TEDGE", timestampformat="%s", maxlines=
             for tp in tp_dict.keys():
                 twopaths.append((tp[0], tp[1], tp[2], tp_dict[tp]))
             Log.add('finished.')
-        return tn.TemporalNetwork(twopaths = twopaths, sep=sep)
+        return tn.TemporalNetwork(twopaths = twopaths, sep=sep, storage=storage)
+
+
+def _getTEdgeColumns(header):
+    """Returns a tuple (source_ix, target_ix, time_ix) containing the column indices of source 
+    nodes, target nodes and time stamps in a TEDGE file with the given (split) header line. 
+    The index of missing columns is -1."""
+    time_ix = -1
+    source_ix = -1
+    target_ix = -1
+    for i in range(len(header)):
+        header[i] = header[i].strip()
+        if header[i] == 'node1' or header[i] == 'source':
+            source_ix = i
+        elif header[i] == 'node2' or header[i] == 'target':
+            target_ix = i
+        elif header[i] == 'time' or header[i] == 'timestamp':
+            time_ix = i
+    return source_ix, target_ix, time_ix
+
+
+def _parseTimestamp(timestamp):
+    """Parses an integer or string time stamp of the form '%Y-%m-%d %H:%M'"""
+    if timestamp.isdigit():
+        return int(timestamp)
+    x = dt.datetime.strptime(timestamp, "%Y-%m-%d %H:%M")
+    return int(time.mktime(x.timetuple()))
+
+
+def streamTwoPaths(filename, delta=1, sep=',', maxlines=sys.maxsize, callback=None, aggregate=True):
+    """ Extracts time-respecting paths of length two from a TEDGE file in a streaming fashion, 
+        without constructing a TemporalNetwork instance. Time-stamped links are read line by 
+        line and passed to a TwoPathStream, which only buffers links within the last delta time 
+        units. The file is expected to contain lines in the format 'v,w,t' ordered by time stamps, 
+        with a header line indicating the semantics of columns (see readFile). This function returns 
+        the TwoPathStream instance, whose method getTwoPaths returns the aggregated two-paths.
+
+        @param filename: the name of the TEDGE file
+        @param delta: the maximum time difference between consecutive links of a two-path
+        @param sep: the separator character used in the file
+        @param maxlines: the maximum number of lines to read
+        @param callback: an optional function callback(s, v, d, weight, time) called for each 
+            occurrence of a two-path (see TwoPathStream)
+        @param aggregate: whether or not to accumulate weights of unique two-paths (see TwoPathStream)
+    """
+    assert filename != ""
+
+    stream = TwoPathStream(delta=delta, callback=callback, aggregate=aggregate)
+
+    with open(filename, 'r') as f:
+        source_ix, target_ix, time_ix = _getTEdgeColumns(f.readline().split(sep))
+        assert source_ix >= 0 and target_ix >= 0 and time_ix >= 0, "Detected invalid header columns"
+
+        Log.add('Streaming time-stamped links ...')
+        line = f.readline()
+        n = 1
+        while line and n <= maxlines:
+            fields = line.rstrip().split(sep)
+            try:
+                e = (fields[source_ix], fields[target_ix], _parseTimestamp(fields[time_ix]))
+            except (IndexError, ValueError):
+                Log.add('Ignoring malformed data in line ' + str(n+1) + ': "' +  line.strip() + '"', Severity.WARNING)
+                e = None
+            if e is not None:
+                stream.addEdge(e[0], e[1], e[2])
+            line = f.readline()
+            n += 1
+    stream.flush()
+    Log.add('finished. Extracted ' + str(stream.tpcount) + ' two-paths.')
+
+    return stream
 
 
 def getSparseAdjacencyMatrix( graph, attribute=None, transposed=False ):
@@ -158,36 +241,21 @@ def getSparseAdjacencyMatrix( graph, attribute=None, transposed=False ):
     if (attribute is not None) and (attribute not in graph.es.attribute_names()):
       raise ValueError( "Attribute does not exists." )
     
-    row = []
-    col = []
-    data = []
+    # read the edge list in bulk
+    edges = np.array(graph.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    if transposed:
+      row = edges[:,1]
+      col = edges[:,0]
+    else:
+      row = edges[:,0]
+      col = edges[:,1]
     
     if attribute is None:
-      if transposed:
-        for edge in graph.es():
-          s,t = edge.tuple
-          row.append(t)
-          col.append(s)
-      else:
-        for edge in graph.es():
-          s,t = edge.tuple
-          row.append(s)
-          col.append(t)
-      data = np.ones(len(graph.es()))
+      data = np.ones(len(edges))
     else:
-      if transposed:
-        for edge in graph.es():
-            s,t = edge.tuple
-            row.append(t)
-            col.append(s)
-      else:
-        for edge in graph.es():
-            s,t = edge.tuple
-            row.append(s)
-            col.append(t)
-      data = np.array(graph.es()[attribute])
+      data = np.array(graph.es[attribute], dtype=np.float64)
 
-    return sparse.coo_matrix((data, (row, col)) , shape=(len(graph.vs), len(graph.vs))).tocsr()
+    return sparse.csr_matrix((data, (row, col)) , shape=(len(graph.vs), len(graph.vs)))
 
 
 def RWTransitionMatrix(g):
@@ -195,51 +263,40 @@ def RWTransitionMatrix(g):
     and directed network
     
     @param g: the graph"""
-    row = []
-    col = []
-    data = []
+    edges = np.array(g.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    s = edges[:,0]
+    t = edges[:,1]
     if g.is_weighted():
-      D = g.strength(mode='out', weights=g.es["weight"])
-      for edge in g.es():
-          s,t = edge.tuple
-          row.append(t)
-          col.append(s)
-          tmp = edge["weight"] / D[s]
-          if tmp <0 or tmp > 1:
-              tn.Log.add('Encountered transition probability outside [0,1] range.', Severity.ERROR)
-              raise ValueError()
-          data.append( tmp )
+      weights = np.array(g.es["weight"], dtype=np.float64)
+      D = np.array(g.strength(mode='out', weights=weights), dtype=np.float64)
     else:
-      D = g.degree(mode='out')
-      for edge in g.es():
-          s,t = edge.tuple
-          row.append(t)
-          col.append(s)
-          tmp = 1. / D[s]
-          if tmp <0 or tmp > 1:
-              tn.Log.add('Encountered transition probability outside [0,1] range.', Severity.ERROR)
-              raise ValueError()
-          data.append( tmp )
-    
-    # TODO: find out why data is some times of type (N, 1)
-    # TODO: and sometimes of type (N,). The latter is desired
-    # TODO: otherwise scipy.coo will raise a ValueError
-    data = np.array(data)
-    data = data.reshape(data.size,)
+      weights = np.ones(len(edges))
+      D = np.array(g.degree(mode='out'), dtype=np.float64)
+
+    # normalise by the out-strength of sources in one step
+    with np.errstate(divide='ignore', invalid='ignore'):
+      data = weights / D[s]
+    if not np.all((data >= 0) & (data <= 1)):
+      tn.Log.add('Encountered transition probability outside [0,1] range.', Severity.ERROR)
+      raise ValueError()
 
-    return sparse.coo_matrix((data, (row, col)), shape=(len(g.vs), len(g.vs))).tocsr()
+    return sparse.csr_matrix((data, (t, s)), shape=(len(g.vs), len(g.vs)))
 
 
-def EntropyGrowthRate(T):
+def EntropyGrowthRate(T, pi=None):
     """Computes the entropy growth rate of a transition matrix
     
-    @param T: Transition matrix in sparse format."""
-    pi = StationaryDistribution(T)
+    @param T: Transition matrix in sparse format.
+    @param pi: the stationary distribution of T. If None, it is computed."""
+    if pi is None:
+        pi = StationaryDistribution(T)
     
-    # directly work on the data object of the sparse matrix
+    # work on a copy of the data object of the sparse matrix, as the 
+    # transition matrix may be cached
     # NOTE: np.log2(T.data) has no problem with elements being zeros
     # NOTE: as we work with a sparse matrix here, where the zero elements
     # NOTE: are not stored
+    T = T.copy()
     T.data *=  np.log2(T.data)
     
     # NOTE: the matrix vector product only works because T is assumed to be
@@ -5,4 +5,5 @@ from .TimeSlices import *
 from .Utilities import *
 from .Visualizer import *
 from .Paths import *
+from .PathQueries import *
 from .Log import *
@@ -8,7 +8,10 @@ Created on Fri Feb 20 11:59:22 2015
 
 import pyTempNet as tn
 import igraph
+import numpy as np
 import pkg_resources
+import tempfile
+import os
 
 # Set up a canonical example network in order to make sure that everything 
 # is calculated correctly
@@ -57,10 +60,179 @@ print("Test network has", t.TwoPathCount(), "two-paths")
 
 assert t.TwoPathCount() == 12
 
+# Filtering retains the number of occurrences of all two-paths passing the filter
+assert t.filterTwoPaths(lambda s,v,d,w: True).TwoPathCount() == 12
+
+# By default, filters are evaluated for the weights of individual occurrences of two-paths
+occurrences = t.twopaths.getOccurrences()
+assert t.filterTwoPaths(lambda s,v,d,w: w > 0.5).TwoPathCount() == (occurrences[3] > 0.5).sum()
+
 
 # Plot the three aggregate networks
 g1 = t.igraphFirstOrder()
 
+# Temporal betweenness for the default start time corresponds to the first time stamp
+bw = tn.Measures.GetTemporalBetweennessInstantaneous(t)
+assert (bw == tn.Measures.GetTemporalBetweennessInstantaneous(t, start_t=t.ordered_times[0])).all()
+assert bw.sum() > 0
+
+# The extracted two-paths correspond to all combinations of in-links (s,v;t) and out-links (v,d;t') 
+# with t < t' <= t+delta, weighted by the inverse numbers of in-links and out-links
+def twoPathWeights(twopaths):
+    weights = {}
+    for (s,v,d,w) in twopaths:
+        weights[(s,v,d)] = weights.get((s,v,d), 0) + w
+    return weights
+
+def sameWeights(a, b):
+    return a.keys() == b.keys() and all(abs(a[k] - b[k]) < 1e-10 for k in a)
+
+reference = []
+for ts in t.ordered_times:
+    for v in t.targets[ts]:
+        for future_t in t.activities[v]:
+            if ts < future_t <= ts + t.delta:
+                for e_in in t.targets[ts][v]:
+                    for e_out in t.sources[future_t][v]:
+                        if e_in[0] != v and v != e_out[1]:
+                            reference.append((e_in[0], v, e_out[1], 1./(len(t.targets[ts][v])*len(t.sources[future_t][v]))))
+assert sameWeights(twoPathWeights(reference), twoPathWeights(t.twopaths))
+assert len(reference) == t.TwoPathCount()
+
+# Extracting two-paths for multiple deltas in a single pass yields the same two-paths as separate extractions
+sweep = t.extractTwoPathSweep([1, 2, 5])
+for delta in [1, 2, 5]:
+    t_delta = tn.TemporalNetwork(tedges=list(t.tedges))
+    t_delta.setMaxTimeDiff(delta=delta)
+    t_delta.extractTwoPaths()
+    assert sameWeights(twoPathWeights(sweep[delta]), twoPathWeights(t_delta.twopaths))
+    assert sweep[delta].totalCount() == t_delta.TwoPathCount()
+assert t.TwoPathCount() == 12
+
+# Two-paths and second-order networks which are updated incrementally when edges are added 
+# correspond to those computed from scratch
+def secondOrderWeights(t, g2):
+    names = t.secondOrderNames(g2)
+    return dict(((names[e.source], names[e.target]), e["weight"]) for e in g2.es)
+
+t_inc = tn.TemporalNetwork(tedges=[e for e in t.tedges if e[2] < 10])
+t_inc.setMaxTimeDiff(delta=2)
+g2_inc = t_inc.igraphSecondOrder()
+t_inc.setIncremental()
+for e in t.tedges:
+    if e[2] >= 10:
+        t_inc.addEdge(e[0], e[1], e[2])
+t_full = tn.TemporalNetwork(tedges=list(t.tedges))
+t_full.setMaxTimeDiff(delta=2)
+t_full.extractTwoPaths()
+assert sameWeights(twoPathWeights(t_inc.twopaths), twoPathWeights(t_full.twopaths))
+assert t_inc.TwoPathCount() == t_full.TwoPathCount()
+assert sameWeights(secondOrderWeights(t_inc, t_inc.igraphSecondOrder()), secondOrderWeights(t_full, t_full.igraphSecondOrder()))
+
+# Streaming extraction of two-paths from time-ordered links yields the same two-paths
+stream = tn.TwoPaths.TwoPathStream(delta=t.delta)
+stream.addEdges(sorted(t.tedges, key=lambda e: e[2]))
+assert sameWeights(twoPathWeights(stream.getTwoPaths()), twoPathWeights(t.twopaths))
+assert stream.getTwoPaths().totalCount() == t.TwoPathCount()
+
+# Parallel extraction of two-paths yields the same two-paths as the serial extraction
+t_par = tn.TemporalNetwork(tedges=list(t.tedges))
+t_par.extractTwoPaths(workers=2)
+assert sameWeights(twoPathWeights(t_par.twopaths), twoPathWeights(t.twopaths))
+assert t_par.TwoPathCount() == t.TwoPathCount()
+
+# Betweenness centralities based on the second-order network, where searches can be distributed among worker processes
+name_map = tn.Utilities.firstOrderNameMap(t)
+bw = tn.Measures.GetStaticBetweenness(t)
+assert bw[name_map['e']] == 9 and bw[name_map['f']] == 2 and bw.sum() == 11
+assert (tn.Measures.GetStaticBetweenness(t, workers=2) == bw).all()
+
+# Distance matrices correspond to the lengths of shortest paths between all pairs of nodes in the 
+# first-order network, and between all pairs of corresponding nodes in the second-order network
+D1 = tn.Paths.GetFirstOrderDistanceMatrix(t)
+g1 = t.igraphFirstOrder()
+for v in range(g1.vcount()):
+    for w in range(g1.vcount()):
+        p = g1.get_shortest_paths(v, w)[0]
+        assert D1[v, w] == (len(p)-1 if len(p) > 0 else np.inf)
+
+D2 = tn.Paths.GetSecondOrderDistanceMatrix(t)
+g2 = t.igraphSecondOrder()
+source, target = t.secondOrderNodes(g2)
+reference = np.full(D2.shape, np.inf)
+np.fill_diagonal(reference, 0)
+for v in range(g2.vcount()):
+    for w in range(g2.vcount()):
+        p = g2.get_shortest_paths(v, w)[0]
+        if len(p) > 0:
+            reference[source[v], target[w]] = min(reference[source[v], target[w]], len(p))
+assert (D2 == reference).all()
+
+# The minimum temporal distances computed in a single reverse-time sweep correspond to the minimum 
+# distances of shortest time-respecting paths across all start times
+for delta in [1, 3]:
+    minD, minPaths = tn.Paths.GetMinTemporalDistance(t, delta=delta, collect_paths=False)
+    reference = np.min([tn.Paths.GetTemporalDistanceMatrix(t, start_t=ts, delta=delta, collect_paths=False)[0] for ts in t.ordered_times], axis=0)
+    assert (minD == reference).all()
+
+# Distance matrices written in blocks of rows to an integer array or to a function correspond to the dense matrices
+def blockSum(f):
+    total = [0]
+    def add(rows, D_rows):
+        total[0] += D_rows[np.isfinite(D_rows)].sum()
+    f(add)
+    return total[0]
+
+for f in [lambda out: tn.Paths.GetFirstOrderDistanceMatrix(t, out=out), 
+          lambda out: tn.Paths.GetSecondOrderDistanceMatrix(t, out=out), 
+          lambda out: tn.Paths.GetMinTemporalDistance(t, delta=3, collect_paths=False, out=out)[0], 
+          lambda out: tn.Paths.GetTemporalDistanceMatrix(t, delta=3, collect_paths=False, out=out)[0]]:
+    D = f(None)
+    D_int = f(np.zeros(D.shape, dtype=np.uint16))
+    assert (np.where(np.isfinite(D), D, np.iinfo(np.uint16).max) == D_int).all()
+    assert blockSum(f) == D[np.isfinite(D)].sum()
+
+# Nodes are reachable via time-respecting paths if and only if their temporal distance is finite
+for delta in [1, 3]:
+    D = tn.Paths.GetTemporalDistanceMatrix(t, delta=delta, collect_paths=False)[0]
+    R = tn.Paths.GetTemporalReachability(t, start_t=t.ordered_times[0], delta=delta, packed=False)
+    assert (R == np.isfinite(D)).all()
+    minD = tn.Paths.GetMinTemporalDistance(t, delta=delta, collect_paths=False)[0]
+    R = tn.Paths.GetTemporalReachability(t, delta=delta, packed=False)
+    assert (R == np.isfinite(minD)).all()
+    assert (tn.Paths.GetTemporalReachSizes(t, delta=delta) == R.sum(axis=1)).all()
+    components = tn.Paths.GetTemporalOutComponents(t, delta=delta)
+    assert all(sorted(components[v]) == sorted(t.nodes[j] for j in np.flatnonzero(R[name_map[v]])) for v in t.nodes)
+
+# For small reach sets, estimated sizes are close to the exact sizes
+for delta in [1, 3]:
+    sizes = tn.Paths.GetTemporalReachSizes(t, delta=delta)
+    assert np.allclose(tn.Paths.GetTemporalReachSizesApprox(t, delta=delta), sizes, rtol=0.1)
+
+# Earliest arrival times are finite if and only if nodes can be reached from the source at the given start time
+index = tn.TemporalPathIndex(t)
+for delta in [1, 3]:
+    D = tn.Paths.GetTemporalDistanceMatrix(t, delta=delta, collect_paths=False)[0]
+    for v in t.nodes:
+        arrival = tn.GetEarliestArrival(t, v, start_t=t.ordered_times[0], delta=delta, index=index)
+        assert (np.isfinite(arrival) == np.isfinite(D[name_map[v]])).all()
+
+# Single time-respecting paths between a pair of nodes, where waiting times are not limited
+assert tn.GetEarliestArrival(t, 'c', 'b', index=index) == (13, [('c', 1), ('e', 2), ('b', 13)])
+assert tn.GetLatestDeparture(t, 'c', 'b', index=index) == (9, [('c', 9), ('e', 10), ('b', 14)])
+assert tn.GetFastestPath(t, 'c', 'b', index=index) == (4, [('c', 9), ('e', 10), ('b', 13)])
+
+# Second-order nodes can be looked up by their readable names v-w
+assert t.igraphSecondOrder().vs["name"] == t.secondOrderNames()
+assert t_inc.igraphSecondOrder().vs["name"] == t_inc.secondOrderNames()
+assert t.igraphSecondOrder().vs.find(name='c,e')["source"] == name_map['c']
+
+# Compute weighted k-cores of second-order nodes, which must leave the second-order network unchanged
+g2 = t.igraphSecondOrder()
+kcore = dict(tn.Measures.WeightedKCore(t, 1, 1))
+assert sorted(kcore.keys()) == sorted(t.secondOrderNames())
+assert t.igraphSecondOrder().vcount() == len(kcore)
+
 # Compute betweenness preference of nodes
 bw = tn.Measures.BetweennessPreference(t, v='e')
 
@@ -91,17 +263,28 @@ igraph.plot(g1, **visual_style)
 g2 = t.igraphSecondOrder()
 visual_style["edge_label"] = str(g2.es["weight"])
 visual_style["layout"] = g2.layout_auto()
-visual_style["vertex_label"] = g2.vs["name"]
+visual_style["vertex_label"] = t.secondOrderNames(g2)
 visual_style["edge_label"] = g2.es["weight"]
 igraph.plot(g2, **visual_style)
 
 g2n = t.igraphSecondOrderNull()
 visual_style["edge_label"] = str(g2n.es["weight"])
 visual_style["layout"] = g2n.layout_auto()
-visual_style["vertex_label"] = g2n.vs["name"]
+visual_style["vertex_label"] = t.secondOrderNames(g2n)
 visual_style["edge_label"] = g2n.es["weight"]
 igraph.plot(g2n, **visual_style)
 
+# Make sure that malformed lines are skipped without shifting subsequent edges
+malformed = tempfile.NamedTemporaryFile(mode='w', suffix='.tedges', delete=False)
+malformed.write('time,source,target\n1,a,b\n2,b\nx,b,c\n4,c,d\n')
+malformed.close()
+for storage in ['DICT', 'ARRAY']:
+    t_malformed = tn.readFile(malformed.name, storage=storage)
+    assert sorted(t_malformed.tedges) == [('a', 'b', 1), ('c', 'd', 4)]
+    assert sorted(t_malformed.nodes) == ['a', 'b', 'c', 'd']
+    assert list(t_malformed.tedges[::-1]) == [('c', 'd', 4), ('a', 'b', 1)]
+os.remove(malformed.name)
+
 # Read temporal network from sample data file
 filename = pkg_resources.resource_filename('pyTempNet', 'example.tedges')
 